@@ -0,0 +1,220 @@
+import argparse
+import math
+from collections import Counter
+import numpy as np
+from psycopg2.extras import execute_values
+from embedding_codec import decode_embeddings, encode_embedding
+from kmeans import assign, normalize, train_minibatch_kmeans
+
+'''
+This file groups the tweets into topic clusters ahead of time, so that /clusters/ only has to read the results. Running it loads every stored embedding,
+trains the centroids with NumPy mini-batch k-means (see kmeans.py) and assigns each tweet to its closest centroid. It then writes:
+* tweets.cluster_id, the cluster of every tweet, which /clusters/{cluster_id}/ pages through with the ix_tweets_cluster_id_id index
+* the clusters table, with each cluster's centroid (float32 bytes, like embedding_vector), its number of tweets and its top terms
+
+The top terms of a cluster are the words of its cleaned text that are common in the cluster but not everywhere else (a class-based TF-IDF), so the words
+every cluster shares do not end up at the top of every list.
+
+The centroids stay in the clusters table, so every tweet preprocessing.py loads afterwards is given the cluster of its closest centroid (see
+ClusterAssigner) without running k-means again. Running this file again retrains the clusters from every tweet in the table and saves them as a new
+generation, with new centroids under the same ids 0 to k - 1.
+
+The two can run at the same time. save_clusters locks the clusters table before it replaces the centroids, and preprocessing.py locks it too at the start
+of every chunk's transaction (ClusterAssigner.assign), then checks the generation and reloads the centroids when it has changed. A chunk written before
+the lock used the old centroids and is assigned again by save_clusters, and a chunk written after it waits for the commit and uses the new ones, so no
+tweet keeps a cluster id (or adds to a cluster's size) from centroids that were replaced.
+'''
+
+# Number of rows fetched from the server-side cursors at a time
+FETCH_SIZE = 5000
+
+# Number of (id, cluster_id) pairs written with one UPDATE
+UPDATE_BATCH_SIZE = 5000
+
+# Number of terms kept for each cluster
+TOP_TERMS = 10
+
+CREATE_CLUSTERS_TABLE = """
+CREATE TABLE IF NOT EXISTS clusters (
+    id INTEGER PRIMARY KEY,
+    size BIGINT NOT NULL DEFAULT 0,
+    top_terms TEXT NOT NULL DEFAULT '',
+    centroid BYTEA NOT NULL,
+    generation BIGINT NOT NULL DEFAULT 0
+)
+"""
+
+# Blocks writers of the clusters table (and preprocessing.py's chunks, which take ROW EXCLUSIVE) until the commit, and conflicts with itself so that two
+# runs of this file cannot save their clusters at the same time
+LOCK_CLUSTERS = "LOCK TABLE clusters IN SHARE ROW EXCLUSIVE MODE"
+
+# Taken by every chunk preprocessing.py writes. Chunks do not block each other, but they wait for (and block) save_clusters
+LOCK_CLUSTERS_FOR_CHUNK = "LOCK TABLE clusters IN ROW EXCLUSIVE MODE"
+
+# Every saved set of clusters has the same generation, which is one more than the one before it
+READ_GENERATION = "SELECT coalesce(max(generation), 0) FROM clusters"
+
+SAVE_CLUSTER_IDS = """
+UPDATE tweets SET cluster_id = assigned.cluster_id FROM (VALUES %s) AS assigned (id, cluster_id)
+WHERE tweets.id = assigned.id AND tweets.cluster_id IS DISTINCT FROM assigned.cluster_id
+"""
+
+COUNT_CLUSTER_SIZES = """
+UPDATE clusters SET size = counts.size
+FROM (SELECT cluster_id, count(*) AS size FROM tweets WHERE cluster_id IS NOT NULL GROUP BY cluster_id) AS counts
+WHERE clusters.id = counts.cluster_id
+"""
+
+
+# Picks a number of clusters that keeps each one at a few thousand tweets, which is still a short list to browse
+def default_n_clusters(n_rows):
+    return max(1, min(200, int(np.sqrt(n_rows / 2))))
+
+
+# Returns the ids (in order) and the normalized embeddings of every tweet after after_id that has an embedding
+def read_embeddings(connection, after_id = 0):
+    ids = []
+    vectors = []
+    # A named cursor is a server-side cursor, so the table is read FETCH_SIZE rows at a time instead of all at once
+    with connection.cursor(name = "cluster_embeddings") as cursor:
+        cursor.itersize = FETCH_SIZE
+        cursor.execute("SELECT id, embedding_vector FROM tweets WHERE embedding_vector IS NOT NULL AND id > %s ORDER BY id", (after_id,))
+        for tweet_id, embedding_vector in cursor:
+            ids.append(tweet_id)
+            vectors.append(bytes(embedding_vector))
+    return np.asarray(ids, dtype = np.int64), normalize(decode_embeddings(vectors))
+
+
+# Returns the closest cluster of every vector, or None for every vector when there are no centroids yet
+def nearest_clusters(vectors, centroids):
+    if centroids is None or len(vectors) == 0:
+        return [None] * len(vectors)
+    matrix = normalize(np.asarray(vectors, dtype = np.float32).reshape(len(vectors), -1))
+    return assign(matrix, centroids).tolist()
+
+
+# Gives the tweets preprocessing.py loads the cluster of their closest centroid. The centroids are kept between chunks and only read again when
+# clusters.py has saved a new generation
+class ClusterAssigner:
+    def __init__(self, connection):
+        # The table is created up front (empty) so that every chunk can lock it, even one written while the very first clusters are being saved
+        with connection.cursor() as cursor:
+            cursor.execute(CREATE_CLUSTERS_TABLE)
+        connection.commit()
+        self.generation = None
+        # A [clusters, dim] matrix, where row i is cluster i, or None when no clusters have been trained
+        self.centroids = None
+
+    # Returns the closest cluster of every encoded embedding, or None for each of them when there are no clusters. It has to run inside the transaction
+    # that writes the rows, since the lock it takes is what keeps save_clusters from replacing the centroids before that transaction commits
+    def assign(self, cursor, embeddings):
+        cursor.execute(LOCK_CLUSTERS_FOR_CHUNK)
+        cursor.execute(READ_GENERATION)
+        generation = cursor.fetchone()[0]
+        if generation != self.generation:
+            cursor.execute("SELECT id, centroid FROM clusters ORDER BY id")
+            records = cursor.fetchall()
+            # The ids are written as 0 to n - 1, so the row of a centroid is its cluster id
+            self.centroids = decode_embeddings([bytes(centroid) for cluster_id, centroid in records]).astype(np.float32) if records else None
+            self.generation = generation
+        return nearest_clusters(decode_embeddings([bytes(embedding) for embedding in embeddings]), self.centroids)
+
+
+# Counts the words of the cleaned text of every tweet per cluster and returns the top n_terms words of each cluster, scored with a class-based TF-IDF:
+# how often the word is used in the cluster, times how rare it is across all of the clusters
+def top_terms(connection, ids, labels, n_clusters, n_terms = TOP_TERMS):
+    counts = [Counter() for _ in range(n_clusters)]
+    with connection.cursor(name = "cluster_texts") as cursor:
+        cursor.itersize = FETCH_SIZE
+        cursor.execute("SELECT id, text FROM tweets WHERE embedding_vector IS NOT NULL AND id <= %s ORDER BY id", (int(ids[-1]),))
+        for tweet_id, text in cursor:
+            # The ids are sorted, so the row of a tweet is found with a binary search instead of a dictionary of every id
+            row = np.searchsorted(ids, tweet_id)
+            if row < len(ids) and ids[row] == tweet_id and text:
+                counts[labels[row]].update(text.split())
+    totals = Counter()
+    for cluster_counts in counts:
+        totals.update(cluster_counts)
+    average_words = sum(totals.values()) / n_clusters
+    terms = []
+    for cluster_counts in counts:
+        words = sum(cluster_counts.values()) or 1
+        scores = {term: count / words * math.log(1 + average_words / totals[term]) for term, count in cluster_counts.items()}
+        terms.append([term for term, score in sorted(scores.items(), key = lambda item: (-item[1], item[0]))[:n_terms]])
+    return terms
+
+
+# Replaces the clusters and writes every tweet's cluster_id in one transaction, so the API never sees centroids and assignments that do not belong together
+def save_clusters(connection, centroids, terms, ids, labels):
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(CREATE_CLUSTERS_TABLE)
+            pairs = list(zip(ids.tolist(), labels.tolist()))
+            for start in range(0, len(pairs), UPDATE_BATCH_SIZE):
+                execute_values(cursor, SAVE_CLUSTER_IDS, pairs[start:start + UPDATE_BATCH_SIZE], page_size = UPDATE_BATCH_SIZE)
+            # The lock waits for the chunks preprocessing.py is writing, and holds back the ones after them until the commit. It is only taken now so that
+            # loading is not held up while the tweets above are updated
+            cursor.execute(LOCK_CLUSTERS)
+            cursor.execute(READ_GENERATION)
+            generation = cursor.fetchone()[0] + 1
+            cursor.execute("DELETE FROM clusters")
+            execute_values(cursor, "INSERT INTO clusters (id, size, top_terms, centroid, generation) VALUES %s",
+                           [(cluster_id, 0, " ".join(terms[cluster_id]), encode_embedding(centroid), generation)
+                            for cluster_id, centroid in enumerate(centroids)])
+            # Tweets that preprocessing.py loaded while the clusters were being trained were given a cluster of the old centroids, so they are assigned
+            # again with the new ones. Every such chunk has committed by now, and the chunks after the lock will see the new generation
+            new_ids, new_vectors = read_embeddings(connection, after_id = int(ids[-1]))
+            if len(new_ids):
+                execute_values(cursor, SAVE_CLUSTER_IDS, list(zip(new_ids.tolist(), assign(new_vectors, centroids).tolist())), page_size = UPDATE_BATCH_SIZE)
+            # The sizes are counted again from the tweets, which also undoes what those chunks added to the old clusters
+            cursor.execute(COUNT_CLUSTER_SIZES)
+            # The cached pages of the API are keyed by the dataset version, so bumping it keeps them from showing the old clusters
+            cursor.execute("SELECT to_regclass('dataset_version')")
+            if cursor.fetchone()[0] is not None:
+                cursor.execute("UPDATE dataset_version SET version = version + 1, updated_at = now()")
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    return len(ids) + len(new_ids)
+
+
+# Trains n_clusters clusters on every stored embedding and saves them. Returns the number of tweets that were given a cluster
+def build_clusters(connection, n_clusters = None, batch_size = 4096, n_steps = 200, seed = 0):
+    ids, matrix = read_embeddings(connection)
+    connection.commit()
+    if len(ids) == 0:
+        raise ValueError("There are no embeddings to cluster")
+    n_clusters = n_clusters or default_n_clusters(len(ids))
+    print(f"Training {n_clusters} clusters on {len(ids)} tweets")
+    centroids = train_minibatch_kmeans(matrix, n_clusters, batch_size = batch_size, n_steps = n_steps, seed = seed)
+    labels = assign(matrix, centroids)
+    # The matrix is no longer needed, and the term counts below can take a lot of memory on a large table
+    del matrix
+    terms = top_terms(connection, ids, labels, n_clusters)
+    connection.commit()
+    return save_clusters(connection, centroids, terms, ids, labels)
+
+
+'''
+Running this file trains the clusters from every embedding in the database and saves them, for example: python clusters.py --n-clusters 100
+The database is the one in database.py (or the DATABASE_URL environment variable). A database created before tweets.cluster_id (or
+clusters.generation) existed needs python migrations/clusters.py (from the data folder) first.
+'''
+if __name__ == "__main__":
+    import psycopg2
+    from database import URL_DATABASE
+
+    parser = argparse.ArgumentParser(description = "Group the tweets into topic clusters with mini-batch k-means over their stored embeddings")
+    parser.add_argument("--n-clusters", type = int, default = None, help = "Number of clusters (defaults to about sqrt(rows / 2), at most 200)")
+    parser.add_argument("--batch-size", type = int, default = 4096, help = "Number of tweets in each mini-batch")
+    parser.add_argument("--n-steps", type = int, default = 200, help = "Number of mini-batches the centroids are trained on")
+    parser.add_argument("--seed", type = int, default = 0, help = "Seed of the random starting centroids and batches")
+    args = parser.parse_args()
+
+    connection = psycopg2.connect(URL_DATABASE)
+    try:
+        count = build_clusters(connection, n_clusters = args.n_clusters, batch_size = args.batch_size, n_steps = args.n_steps, seed = args.seed)
+        print(f"Assigned {count} tweets to their clusters")
+    finally:
+        connection.close()
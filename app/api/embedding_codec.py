@@ -0,0 +1,27 @@
+import numpy as np
+
+'''
+The embedding_vector column stores each embedding as raw float32 bytes (a bytea column) instead of the text of a Python list. 768 float32 values take 3,072
+bytes, compared to roughly 15 KB of text, and reading them back is a single np.frombuffer call instead of json.loads. preprocessing.py uses encode_embedding
+to write the column and main.py uses decode_embedding and decode_embeddings to read it, so both sides always agree on the format.
+'''
+
+EMBEDDING_DTYPE = np.dtype('<f4')
+
+
+# Converts an embedding into the bytes that are stored in the embedding_vector column
+def encode_embedding(vector):
+    return np.asarray(vector, dtype = EMBEDDING_DTYPE).ravel().tobytes()
+
+
+# Converts the bytes stored in the embedding_vector column back into a float32 array. psycopg2 returns bytea values as memoryview objects, which are read
+# without copying
+def decode_embedding(data):
+    return np.frombuffer(data, dtype = EMBEDDING_DTYPE)
+
+
+# Converts a list of stored embeddings into one [len(values), dim] float32 matrix
+def decode_embeddings(values):
+    if not values:
+        return np.empty((0, 0), dtype = EMBEDDING_DTYPE)
+    return np.frombuffer(b''.join(values), dtype = EMBEDDING_DTYPE).reshape(len(values), -1)
@@ -0,0 +1,142 @@
+import argparse
+import os
+import threading
+import numpy as np
+from kmeans import assign, train_kmeans
+
+'''
+The IVFIndex is an optional approximate nearest neighbour index for /similar_tweets/. An exact search compares the target tweet with every row in the vector
+store, so its cost grows with the table. The IVF (inverted file) index clusters the normalized embeddings around n_lists coarse centroids and keeps a list of
+the tweets that belong to each centroid. A search only compares the target with the centroids and then scans the nprobe lists whose centroids are closest,
+which touches roughly nprobe / n_lists of the table. A higher nprobe gives better recall at the cost of speed.
+
+The index is saved to disk as a .npz file, and tweets that are loaded after it was built are added to the closest existing list without retraining.
+'''
+
+# Number of lists probed per search when the caller does not ask for a specific number
+NPROBE = 8
+
+
+# Picks a number of lists that keeps each list at a few hundred to a few thousand rows. 4 * sqrt(n_rows) is more than n_rows below 16 rows, so it is never
+# allowed to go above the number of rows
+def default_n_lists(n_rows):
+    return max(1, min(4096, n_rows, int(4 * np.sqrt(n_rows))))
+
+
+class IVFIndex:
+    def __init__(self, centroids):
+        self.centroids = np.asarray(centroids, dtype = np.float32)
+        # An (ids, vectors) tuple for every list. add replaces a list's tuple as a whole, so a search that reads it without the lock never pairs the ids of
+        # one version of the list with the vectors of another
+        self.lists = [(np.empty(0, dtype = np.int64), np.empty((0, self.centroids.shape[1]), dtype = np.float32)) for _ in range(len(self.centroids))]
+        # Maps every tweet id in the index to the list it belongs to
+        self.lists_by_id = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.lists_by_id)
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    # Trains the centroids on the normalized matrix and fills the lists
+    @classmethod
+    def build(cls, ids, matrix, n_lists = None, n_iter = 20, seed = 0, sample_size = 100000):
+        # Every list needs at least one row to start its centroid from, so a small table gets fewer lists than asked for
+        n_lists = min(n_lists or default_n_lists(len(ids)), max(1, len(ids)))
+        index = cls(train_kmeans(matrix, n_lists, n_iter = n_iter, seed = seed, sample_size = sample_size))
+        index.add(ids, matrix)
+        return index
+
+    # Adds normalized vectors to the lists of their closest centroids. Ids that are already in the index are skipped. Returns the number of rows added
+    def add(self, ids, matrix):
+        ids = np.asarray(ids, dtype = np.int64)
+        with self._lock:
+            new = np.fromiter((int(tweet_id) not in self.lists_by_id for tweet_id in ids), dtype = bool, count = len(ids))
+            ids, matrix = ids[new], matrix[new]
+            if len(ids) == 0:
+                return 0
+            labels = assign(matrix, self.centroids)
+            for list_number in np.unique(labels):
+                members = labels == list_number
+                list_ids, list_vectors = self.lists[list_number]
+                self.lists[list_number] = (np.concatenate([list_ids, ids[members]]), np.concatenate([list_vectors, matrix[members]]))
+            self.lists_by_id.update(zip(ids.tolist(), labels.tolist()))
+        return len(ids)
+
+    # Returns a list of (tweet_id, similarity) tuples for the top_n tweets closest to a normalized query vector, most similar first
+    def search(self, query_vector, top_n = 10, nprobe = NPROBE, exclude_id = None):
+        nprobe = max(1, min(nprobe, self.n_lists))
+        # Pick the nprobe lists whose centroids are closest to the query
+        centroid_scores = self.centroids @ query_vector
+        probed = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        # Each probed list is read once, so its ids and vectors always come from the same version of it
+        probed_lists = [self.lists[list_number] for list_number in probed]
+        ids = np.concatenate([list_ids for list_ids, list_vectors in probed_lists])
+        vectors = np.concatenate([list_vectors for list_ids, list_vectors in probed_lists])
+        scores = vectors @ query_vector
+        if exclude_id is not None:
+            scores[ids == exclude_id] = -np.inf
+        top_n = min(top_n, int(np.isfinite(scores).sum()))
+        if top_n <= 0:
+            return []
+        top_rows = np.argpartition(-scores, top_n - 1)[:top_n]
+        top_rows = top_rows[np.argsort(-scores[top_rows])]
+        return [(int(ids[row]), float(scores[row])) for row in top_rows]
+
+    # Saves the centroids and the lists to a .npz file
+    def save(self, path):
+        with self._lock:
+            sizes = np.array([len(list_ids) for list_ids, list_vectors in self.lists], dtype = np.int64)
+            # Write to a temporary file first so that a crash never leaves a half written index behind
+            temporary_path = f"{path}.tmp.npz"
+            np.savez(temporary_path, centroids = self.centroids, sizes = sizes,
+                     ids = np.concatenate([list_ids for list_ids, list_vectors in self.lists]),
+                     vectors = np.concatenate([list_vectors for list_ids, list_vectors in self.lists]))
+            os.replace(temporary_path, path)
+
+    # Loads an index that was saved with save
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            index = cls(data['centroids'])
+            offsets = np.concatenate([[0], np.cumsum(data['sizes'])])
+            ids, vectors = data['ids'], data['vectors']
+        for list_number in range(index.n_lists):
+            start, end = offsets[list_number], offsets[list_number + 1]
+            index.lists[list_number] = (ids[start:end], vectors[start:end])
+            index.lists_by_id.update((int(tweet_id), list_number) for tweet_id in ids[start:end])
+        return index
+
+
+'''
+Running this file builds the index from every embedding in the database and saves it, for example: python ivf_index.py --n-lists 256
+With --add, the saved index is loaded and only the tweets that are not in it yet are added.
+'''
+if __name__ == "__main__":
+    from database import SessionLocal
+    from vector_store import VectorStore
+
+    parser = argparse.ArgumentParser(description = "Build or update the IVF index used by /similar_tweets/?mode=approximate")
+    parser.add_argument("--path", default = os.environ.get("IVF_INDEX_PATH", "ivf_index.npz"), help = "Where the index is saved")
+    parser.add_argument("--n-lists", type = int, default = None, help = "Number of coarse centroids (defaults to about 4 * sqrt(rows))")
+    parser.add_argument("--n-iter", type = int, default = 20, help = "Number of k-means iterations")
+    parser.add_argument("--add", action = "store_true", help = "Add new tweets to the saved index instead of rebuilding it")
+    args = parser.parse_args()
+
+    store = VectorStore()
+    db = SessionLocal()
+    try:
+        store.refresh(db)
+    finally:
+        db.close()
+
+    matrix, ids, rows = store.snapshot()
+    if args.add:
+        index = IVFIndex.load(args.path)
+        print(f"Added {index.add(ids, matrix)} tweets")
+    else:
+        index = IVFIndex.build(ids, matrix, n_lists = args.n_lists, n_iter = args.n_iter)
+        print(f"Built an index of {len(index)} tweets in {index.n_lists} lists")
+    index.save(args.path)
@@ -0,0 +1,109 @@
+import numpy as np
+
+'''
+nltk's KMeansClusterer compares every vector to every mean one pair at a time in pure Python, which is far too slow for thousands of 768 value embeddings.
+These functions run spherical k-means with NumPy instead: the embeddings and centroids all have a length of 1, so the closest centroid is the one with the
+largest dot product and a whole batch of rows is assigned with a single matrix product.
+'''
+
+# Number of rows assigned to their closest centroid at a time, which keeps the [rows, centroids] score matrix small
+ASSIGN_BATCH_SIZE = 8192
+
+
+# Returns the index of the closest centroid for every row of the matrix
+def assign(matrix, centroids, batch_size = ASSIGN_BATCH_SIZE):
+    labels = np.empty(len(matrix), dtype = np.int64)
+    for start in range(0, len(matrix), batch_size):
+        labels[start:start + batch_size] = np.argmax(matrix[start:start + batch_size] @ centroids.T, axis = 1)
+    return labels
+
+
+# Scales each row (a centroid or an embedding) to a length of 1 and returns float32 values. Rows that are all zeros are left as they are. The vector store
+# and main.py normalize the embeddings and query vectors with it too, so every search compares vectors scaled the same way
+def normalize(matrix):
+    norms = np.linalg.norm(matrix, axis = 1, keepdims = True)
+    norms[norms == 0] = 1
+    return (matrix / norms).astype(np.float32)
+
+
+# Adds up the rows that belong to each cluster and returns (sums, counts)
+def _cluster_sums(matrix, labels, n_clusters):
+    counts = np.bincount(labels, minlength = n_clusters)
+    sums = np.zeros((n_clusters, matrix.shape[1]), dtype = np.float64)
+    order = np.argsort(labels, kind = 'stable')
+    starts = np.searchsorted(labels[order], np.arange(n_clusters))
+    filled = counts > 0
+    if filled.any():
+        sums[filled] = np.add.reduceat(matrix[order], starts[filled], axis = 0)
+    return sums, counts
+
+
+# Trains n_clusters centroids on the L2 normalized rows of matrix. When sample_size is given, the centroids are trained on a random sample of that many rows,
+# which is usually enough to place them well and keeps the training time flat as the table grows
+def train_kmeans(matrix, n_clusters, n_iter = 20, seed = 0, sample_size = None):
+    rng = np.random.default_rng(seed)
+    if sample_size is not None and len(matrix) > sample_size:
+        matrix = matrix[rng.choice(len(matrix), sample_size, replace = False)]
+    if n_clusters > len(matrix):
+        raise ValueError(f"Cannot train {n_clusters} clusters on {len(matrix)} rows")
+    centroids = matrix[rng.choice(len(matrix), n_clusters, replace = False)].astype(np.float32)
+    for _ in range(n_iter):
+        labels = assign(matrix, centroids)
+        sums, counts = _cluster_sums(matrix, labels, n_clusters)
+        # A cluster that lost all of its rows is restarted on a random row so that every centroid stays in use
+        empty = np.flatnonzero(counts == 0)
+        sums[empty] = matrix[rng.choice(len(matrix), len(empty), replace = False)]
+        new_centroids = normalize(sums)
+        if np.allclose(new_centroids, centroids, atol = 1e-6):
+            centroids = new_centroids
+            break
+        centroids = new_centroids
+    return centroids
+
+
+# Picks n_clusters starting centroids from the rows of matrix with greedy k-means++. Each new centroid is picked from a few candidate rows, drawn with a
+# probability that grows with their distance to the closest centroid so far, and the candidate that brings the rows closest to their centroids is kept.
+# This spreads the centroids over the data instead of leaving several of them in the same dense region
+def _kmeans_plus_plus(matrix, n_clusters, rng):
+    n_candidates = 2 + int(np.log(n_clusters))
+    centroids = np.empty((n_clusters, matrix.shape[1]), dtype = np.float32)
+    centroids[0] = matrix[rng.integers(0, len(matrix))]
+    # For rows with a length of 1, the squared distance to a centroid is 2 - 2 * their dot product
+    distances = np.maximum(2 - 2 * (matrix @ centroids[0]), 0)
+    for number in range(1, n_clusters):
+        total = distances.sum()
+        if total > 0:
+            candidates = rng.choice(len(matrix), n_candidates, p = distances / total)
+        else:
+            candidates = rng.integers(0, len(matrix), size = n_candidates)
+        # [rows, candidates] distances if each candidate were added
+        candidate_distances = np.minimum(distances[:, None], np.maximum(2 - 2 * (matrix @ matrix[candidates].T), 0))
+        best = np.argmin(candidate_distances.sum(axis = 0))
+        centroids[number] = matrix[candidates[best]]
+        distances = candidate_distances[:, best]
+    return centroids
+
+
+# Trains n_clusters centroids with mini-batch k-means (Sculley, "Web-Scale K-Means Clustering"). Each step assigns a random batch of batch_size rows and
+# moves every centroid towards the mean of the rows it was given, by a step that gets smaller as the centroid collects more rows. A step costs the same no
+# matter how large the table is, so every stored embedding can take part in the training without a full pass over the matrix on every iteration. The
+# starting centroids are picked with k-means++ on a random sample of init_size rows (3 * batch_size by default)
+def train_minibatch_kmeans(matrix, n_clusters, batch_size = 4096, n_steps = 200, seed = 0, init_size = None):
+    rng = np.random.default_rng(seed)
+    if n_clusters > len(matrix):
+        raise ValueError(f"Cannot train {n_clusters} clusters on {len(matrix)} rows")
+    init_size = min(len(matrix), max(init_size or 3 * batch_size, n_clusters))
+    centroids = _kmeans_plus_plus(matrix[rng.choice(len(matrix), init_size, replace = False)], n_clusters, rng)
+    # The number of rows each centroid has been given so far
+    counts = np.zeros(n_clusters, dtype = np.int64)
+    for _ in range(n_steps):
+        batch = matrix[rng.integers(0, len(matrix), size = min(batch_size, len(matrix)))]
+        labels = assign(batch, centroids)
+        sums, batch_counts = _cluster_sums(batch, labels, n_clusters)
+        counts += batch_counts
+        moved = batch_counts > 0
+        # With a learning rate of 1 / count for every row, the new centroid is the average of the old one (weighted by the rows it had before) and the
+        # rows of this batch
+        updated = centroids[moved] + (sums[moved] - batch_counts[moved, None] * centroids[moved]) / counts[moved, None]
+        centroids[moved] = normalize(updated)
+    return centroids
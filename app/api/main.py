@@ -1,20 +1,27 @@
+import os
+import time
+import anyio.to_thread
+from contextlib import asynccontextmanager
 from datetime import date
 from pydantic import BaseModel
-from typing import List, Annotated, Dict, Optional
+from typing import List, Annotated, Dict, Optional, Literal
 from fastapi import FastAPI, HTTPException, Depends, Query, Request
-from fastapi.responses import RedirectResponse
+from fastapi.responses import PlainTextResponse, RedirectResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 import models
-from database import engine, SessionLocal
+from database import engine, SessionLocal, POOL_SIZE, MAX_OVERFLOW
+from sqlalchemy import REAL, cast, func, tuple_
 from sqlalchemy.orm import Session
 from starlette.responses import HTMLResponse
-from starlette.status import HTTP_400_BAD_REQUEST
-from collections import defaultdict
-import nltk
-from nltk.cluster import KMeansClusterer
-import numpy as np
+from starlette.status import HTTP_400_BAD_REQUEST, HTTP_503_SERVICE_UNAVAILABLE
 import json
+from vector_store import VectorStore
+from embedding_codec import decode_embedding
+from ivf_index import NPROBE, IVFIndex
+from kmeans import normalize
+from query_cache import cache_from_environment
+from metrics import REQUEST_DURATION, instrument_engine, render_metrics, span
 
 '''
 The concepts that make up this file and the html files in the templates folder come from the Udemy Courses: "Learn FastAPI, Python, REST APIs, Bootstrap, SQLite,
@@ -25,8 +32,46 @@ app with PostgreSQL"
 # Using Jinja2 makes it easier to generate dynamic web pages with python
 templates = Jinja2Templates(directory = "templates")
 
+# Renders a template inside a span, so the time Jinja takes shows up in /metrics next to the time spent fetching the data
+def render_template(name, context):
+    with span(f"render.{name}"):
+        return templates.TemplateResponse(name, context)
+
+# Times every query the app sends to the database (see metrics.py)
+instrument_engine(engine)
+
+# Holds every tweet's embedding in memory so that /similar_tweets/ does not have to load the whole table on each request
+vector_store = VectorStore()
+
+# The approximate (IVF) index is optional. It is built with "python ivf_index.py" and only used when the file exists
+IVF_INDEX_PATH = os.environ.get("IVF_INDEX_PATH", "ivf_index.npz")
+ivf_index = None
+
+# Keeps the results of /most_frequent/, /similar_tweets/ and /tweets_by_date/ for repeated calls with the same parameters (see query_cache.py)
+query_cache = cache_from_environment(engine)
+
+# The endpoints that use the database are plain "def" functions, so FastAPI runs each of them in a worker thread and a slow query never blocks the event
+# loop for other requests. API_THREADS sets how many requests can run at once. It defaults to the largest number of connections the pool in database.py will
+# open, since any extra threads would only wait for a connection
+API_THREADS = int(os.environ.get("API_THREADS", POOL_SIZE + MAX_OVERFLOW))
+
+# Sizes the worker thread pool, builds the vector store and loads the IVF index once when the app starts
+@asynccontextmanager
+async def lifespan(app):
+    global ivf_index
+    anyio.to_thread.current_default_thread_limiter().total_tokens = API_THREADS
+    db = SessionLocal()
+    try:
+        with span("vector_store.refresh"):
+            vector_store.refresh(db)
+    finally:
+        db.close()
+    if os.path.exists(IVF_INDEX_PATH):
+        ivf_index = IVFIndex.load(IVF_INDEX_PATH)
+    yield
+
 # Creates an instance of FastAPI
-app = FastAPI()
+app = FastAPI(lifespan = lifespan)
 
 # Loads in the table that was created in the preprocessing.py file
 models.Base.metadata.reflect(bind = engine)
@@ -34,6 +79,20 @@ models.Base.metadata.reflect(bind = engine)
 # Mount the static directory as a route to serve static files for the web page
 app.mount("/static", StaticFiles(directory = "static"), name = "static")
 
+# Records how long every request takes, per endpoint (the route's path, so /similar_tweets/?tweet_id=1 and ?tweet_id=2 are counted together), method and
+# status code. For the NDJSON exports this is the time until the first bytes are sent, not until the whole stream has been written
+@app.middleware("http")
+async def record_request_duration(request: Request, call_next):
+    start = time.perf_counter()
+    status = "500"
+    try:
+        response = await call_next(request)
+        status = str(response.status_code)
+        return response
+    finally:
+        route = request.scope.get("route")
+        REQUEST_DURATION.observe(time.perf_counter() - start, route.path if route else "unmatched", request.method, status)
+
 
 # Create a class that represents the table in PostgreSQL
 class Tweets(BaseModel):
@@ -55,6 +114,31 @@ def get_db():
 # Creates a variable, db_dependency, using the get_db function above to easily open and close a session within the endpoints
 db_dependency = Annotated[Session, Depends(get_db)]
 
+# Copies the columns the templates show into a dictionary. Cached results hold these instead of ORM objects, which are tied to the session that loaded them
+def tweet_row(tweet):
+    return {"id": tweet.id, "created_at": tweet.created_at, "lang": tweet.lang, "text": tweet.text, "full_text": tweet.full_text,
+            "sentiment": tweet.sentiment, "sentiment_val": tweet.sentiment_val}
+
+# Returns the link to the next page, or None on the last page
+def next_page_url(request, cursor):
+    return request.url.include_query_params(cursor = cursor) if cursor else None
+
+# Filters a query to the rows that come after the cursor (after is None on the first page) and sorts them in the order the pages go through them
+def after_cursor(query, order, after):
+    if after is not None:
+        query = query.filter(after)
+    return query.order_by(*order)
+
+# Returns one page of at most limit rows and the cursor for the next page, which encode_cursor makes from the last row, or None on the last page. Every
+# paged endpoint uses it with its own order and cursor condition
+def fetch_page(query, order, after, limit, encode_cursor):
+    # One extra row is fetched to find out whether there is a next page
+    rows = after_cursor(query, order, after).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1])
+
 '''
 The next section of code includes the endpoints and the functions that are utilized by the endpoints.
 '''
@@ -64,68 +148,159 @@ The next section of code includes the endpoints and the functions that are utili
 async def root(request: Request):
     return RedirectResponse(url = "/home")
 
-# The home page just includes the 10 (by default) most recent tweets
+'''
+/home/ and /tweets_by_date/ are paged with a keyset (cursor) on (created_at, id) instead of offset(skip). The cursor holds the date and id of the last tweet
+on the current page, and the next page starts right after it through the ix_tweets_created_at_id index, so every page costs the same no matter how deep it
+is. Both endpoints can also return format=ndjson, which streams one JSON object per line straight from a server-side cursor so that exporting a long date
+range never holds every row in memory.
+'''
+
+# Number of rows fetched from the server-side cursor at a time when streaming NDJSON
+STREAM_BATCH_SIZE = 1000
+
+# The columns written for each tweet in the NDJSON output
+EXPORT_COLUMNS = (models.Tweets.id, models.Tweets.created_at, models.Tweets.lang, models.Tweets.text, models.Tweets.full_text,
+                  models.Tweets.sentiment, models.Tweets.sentiment_val)
+
+# Turns the (created_at, id) of the last tweet on a page into the cursor for the next page, and back
+def encode_date_cursor(tweet):
+    return f"{tweet.created_at.isoformat()}:{tweet.id}"
+
+# Returns None when there is no cursor (the first page). The endpoints decode the cursor before anything else, so an invalid one is a 400 even for an NDJSON
+# stream, whose status has already been sent by the time its generator runs
+def decode_date_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        created_at, tweet_id = cursor.split(":")
+        return date.fromisoformat(created_at), int(tweet_id)
+    except ValueError:
+        raise HTTPException(status_code = HTTP_400_BAD_REQUEST, detail = "Invalid cursor")
+
+# Returns the (created_at, id) ordering and the condition for the rows after last_key, the decoded cursor (None on the first page). newest_first pages
+# backwards in time
+def date_keyset(last_key, newest_first):
+    key = tuple_(models.Tweets.created_at, models.Tweets.id)
+    after = None
+    if last_key:
+        after = key < tuple_(*last_key) if newest_first else key > tuple_(*last_key)
+    if newest_first:
+        return (models.Tweets.created_at.desc(), models.Tweets.id.desc()), after
+    return (models.Tweets.created_at, models.Tweets.id), after
+
+# Streams every tweet that matches the filters as NDJSON. It opens its own session because the response is still being sent after the endpoint returns,
+# and fetches plain rows (not ORM objects) through a server-side cursor, STREAM_BATCH_SIZE rows at a time
+def stream_ndjson(filters, last_key, newest_first):
+    db = SessionLocal()
+    try:
+        query = after_cursor(db.query(*EXPORT_COLUMNS).filter(*filters), *date_keyset(last_key, newest_first))
+        result = db.execute(query.statement.execution_options(yield_per = STREAM_BATCH_SIZE))
+        for rows in result.partitions():
+            yield "".join(json.dumps({column.key: value for column, value in zip(EXPORT_COLUMNS, row)}, default = str) + "\n" for row in rows)
+    finally:
+        db.close()
+
+# The home page just includes the 10 (by default) most recent tweets, with a link to the next 10
 @app.get("/home/")
-async def get_top_tweets(db: db_dependency, request: Request, skip: int = 0, limit: int = 10):
+def get_top_tweets(db: db_dependency, request: Request, limit: int = Query(10, ge = 1, le = 100), cursor: Optional[str] = None,
+                   format: Literal["html", "ndjson"] = "html"):
+    last_key = decode_date_cursor(cursor)
+    if format == "ndjson":
+        return StreamingResponse(stream_ndjson([], last_key, newest_first = True), media_type = "application/x-ndjson")
     # the tweets variable represents the results of the database query that occurs after db.query()
-    tweets = db.query(models.Tweets).offset(skip).limit(limit).all()
+    order, after = date_keyset(last_key, newest_first = True)
+    with span("home.page"):
+        tweets, next_cursor = fetch_page(db.query(models.Tweets), order, after, limit, encode_date_cursor)
     # the home.html is returned with the tweets query values displayed in the body of the web page
-    return  templates.TemplateResponse("home.html", {"request": request, "tweets":tweets, "title": "Home"})
+    return  render_template("home.html", {"request": request, "tweets":tweets, "next_url": next_page_url(request, next_cursor), "title": "Home"})
 
-# The first main endpoint, tweets_by_date, takes two dates (defaulted as 1/1/2018 and 1/10/2018) and returns all of the tweets found between and including
-# those dates
+# The first main endpoint, tweets_by_date, takes two dates (defaulted as 1/1/2018 and 1/10/2018) and returns the tweets found between and including
+# those dates, oldest first, limit tweets per page. format=ndjson streams every tweet in the range instead
 @app.get("/tweets_by_date/")
-async def get_tweet_by_date(db: db_dependency, request: Request, start_date: date , end_date: date):
-    tweets = db.query(models.Tweets).filter(models.Tweets.created_at >= start_date, models.Tweets.created_at <= end_date).all()
-    return  templates.TemplateResponse("home.html", {"request": request, "tweets":tweets, "title": "Tweets By Date"})
+def get_tweet_by_date(db: db_dependency, request: Request, start_date: date , end_date: date, limit: int = Query(50, ge = 1, le = 500),
+                      cursor: Optional[str] = None, format: Literal["html", "ndjson"] = "html"):
+    filters = [models.Tweets.created_at >= start_date, models.Tweets.created_at <= end_date]
+    last_key = decode_date_cursor(cursor)
+    if format == "ndjson":
+        return StreamingResponse(stream_ndjson(filters, last_key, newest_first = False), media_type = "application/x-ndjson")
+
+    # The page (as plain dictionaries) and the next cursor are cached together
+    def compute():
+        order, after = date_keyset(last_key, newest_first = False)
+        with span("tweets_by_date.page"):
+            tweets, next_cursor = fetch_page(db.query(models.Tweets).filter(*filters), order, after, limit, encode_date_cursor)
+            return [tweet_row(tweet) for tweet in tweets], next_cursor
+
+    params = {"start_date": start_date, "end_date": end_date, "limit": limit, "cursor": cursor}
+    tweets, next_cursor = query_cache.get_or_compute("tweets_by_date", params, compute)
+    return  render_template("home.html", {"request": request, "tweets":tweets, "next_url": next_page_url(request, next_cursor),
+                                          "title": "Tweets By Date"})
 
-# The next endpoint, tweets_by_keyword, takes a keyword (defaulted as 'politics') and finds all tweets that contain that keyword
+# Turns the (tweet, rank) result of the last tweet on a page into the cursor for the next page, and back
+def encode_keyword_cursor(result):
+    tweet, rank = result
+    return f"{rank!r}:{tweet.id}"
+
+def decode_keyword_cursor(cursor):
+    try:
+        rank, tweet_id = cursor.split(":")
+        return float(rank), int(tweet_id)
+    except ValueError:
+        raise HTTPException(status_code = HTTP_400_BAD_REQUEST, detail = "Invalid cursor")
+
+# The next endpoint, tweets_by_keyword, takes a keyword (defaulted as 'politics') and finds the tweets that contain that keyword. The search runs against the
+# search_vector column through its GIN index. The keyword can hold several words (all of them have to match), "quoted phrases", "or" and -excluded words, and
+# the results are ranked by relevance. Each page holds up to limit tweets, and the link to the next page carries a cursor with the rank and id of the last
+# tweet on this page
 @app.get("/tweets_by_keyword/")
-async def get_tweet_by_keyword(db: db_dependency, request: Request, keyword: str):
-    tweets = db.query(models.Tweets).filter(models.Tweets.full_text.contains(keyword)).all()
-    return  templates.TemplateResponse("home.html", {"request": request, "tweets":tweets, "title": "Tweets By Keyword"})
+def get_tweet_by_keyword(db: db_dependency, request: Request, keyword: str, limit: int = Query(20, ge = 1, le = 100), cursor: Optional[str] = None):
+    query_vector = func.websearch_to_tsquery('english', keyword)
+    rank = func.ts_rank_cd(models.Tweets.search_vector, query_vector)
+    query = db.query(models.Tweets, rank).filter(models.Tweets.search_vector.op('@@')(query_vector))
+    after = None
+    if cursor:
+        last_rank, last_id = decode_keyword_cursor(cursor)
+        after = tuple_(rank, models.Tweets.id) < tuple_(cast(last_rank, REAL), last_id)
+    with span("tweets_by_keyword.search"):
+        results, next_cursor = fetch_page(query, (rank.desc(), models.Tweets.id.desc()), after, limit, encode_keyword_cursor)
+    tweets = [tweet for tweet, tweet_rank in results]
+    return  render_template("home.html", {"request": request, "tweets":tweets, "next_url": next_page_url(request, next_cursor),
+                                          "title": "Tweets By Keyword"})
 
 # This code largely comes from https://www.geeksforgeeks.org/python-program-for-most-frequent-word-in-strings-list/
-# but was edited to meet the project requirements 
-def get_count(tweet_list, rank):
-    # defaultdict is a fast way to initialize a dictionary that uses a default value of 0
-    temp = defaultdict(int)
-    # tweet_list is a list of all tweets, created in the endpoint below. in this instance, sub is a single tweet
-    for sub in tweet_list:
-        # word represents each word that comes out of the sub.split() method
-        for word in sub.split():
-            # using the word as a key value, temp adds one to the value each time it encounters the word
-            temp[word] += 1
-    # sorted_words is a sorted list by the number values (x[1]) of each temp dictionary pair and then sorts by descending 
-    sorted_words = sorted(temp.items(), key = lambda x: x[1], reverse = True)
-    # rank_list is an empy list that will contain the N number of items, depending on the value of rank
-    rank_list = []
-    # Initialize i at 0 so that it can iterate through sorted_words until it is equal to rank
-    i = 0
-    while i <= rank:
-        rank_list.append(sorted_words[i])
-        i += 1
-    # Prevent users from asking for a rank value that is larger than the total number of unique words
-    if rank <= len(sorted_words):
-        result = rank_list
-    else:
-        result = f"Error. There are only {len(sorted_words)}. Please choose a value equal to or fewer than {len(sorted_words)}"
-    return result
+# but was edited to meet the project requirements. The words are now counted once at ingest (see the term_counts table), and the database adds up the
+# per-day counts and returns only the rank most common words, so the response does not grow with the size of the vocabulary. query selects from
+# term_counts, already limited to the requested days
+def get_count(query, rank):
+    # Ties are broken by the word, so the same request always returns the same list
+    total = func.sum(models.TermCounts.count)
+    with span("most_frequent.top_n"):
+        top_words = query.with_entities(models.TermCounts.term, total).group_by(models.TermCounts.term).order_by(total.desc(), models.TermCounts.term).limit(rank).all()
+    # Prevent users from asking for a rank value that is larger than the total number of unique words. Fewer than rank rows back means that every word was
+    # returned, so their number is the number of unique words and no second count of the vocabulary is needed
+    n_terms = len(top_words)
+    if rank > n_terms:
+        raise HTTPException(status_code = HTTP_400_BAD_REQUEST,
+                            detail = f"Error. There are only {n_terms}. Please choose a value equal to or fewer than {n_terms}")
+    return [(term, int(count)) for term, count in top_words]
 
-# The next endpoint utilized the function above, get_count(), to find the top N (10 by defauly) most frequently used words
+# The next endpoint utilized the function above, get_count(), to find the top N (10 by defauly) most frequently used words. start_date and end_date are
+# optional and limit the count to the tweets from those days
 @app.get("/most_frequent/")
-async def get_most_frequent(db:db_dependency, request: Request, n: int):
-    # In order to begin at 0, but allow the user to type in the number they want to see, n has to equal 1 less than the input value
-    n = n -1
-    # Only use the cleaned 'text' value to prevent stop words, like 'the' to be chosen as the most common word
-    tweets = db.query(models.Tweets.text).all()
-    # Creates a list of tweets so that get_count can iterate and split them
-    full_texts = [tweet for (tweet,) in tweets]
-    # Initiate get_count and return the result to the result variable 
-    result = get_count(full_texts, n)
-    # Display the result on the web page as n + 1, to revise the 1 that was subtracted earlier
-    #return {f"The Top {n+1} Most Frequest Word(s) is": result}
-    return  templates.TemplateResponse("most_frequent.html", {"request": request, "tweets":result, "title": "Most Frequent Words"})
+def get_most_frequent(db:db_dependency, request: Request, n: int = Query(..., ge = 1), start_date: Optional[date] = None, end_date: Optional[date] = None):
+    def compute():
+        # Only use the counts of the cleaned 'text' value to prevent stop words, like 'the' to be chosen as the most common word. The per-day counts are
+        # added up in the database, so the work depends on the size of the vocabulary rather than the number of tweets
+        query = db.query(models.TermCounts)
+        if start_date is not None:
+            query = query.filter(models.TermCounts.day >= start_date)
+        if end_date is not None:
+            query = query.filter(models.TermCounts.day <= end_date)
+        # Initiate get_count and return the result to the result variable 
+        return get_count(query, n)
+
+    result = query_cache.get_or_compute("most_frequent", {"n": n, "start_date": start_date, "end_date": end_date}, compute)
+    return  render_template("most_frequent.html", {"request": request, "tweets":result, "title": "Most Frequent Words"})
 
 '''
 The last endpoint, which finds the similarity between tweets using cosine similarity was influenced by a couple of resources. The first was a Udemy course 
@@ -135,49 +310,99 @@ Clustering text" by Nikita Sharma, found at: https://techblog.assignar.com/how-t
 the preprocessing file. 
 '''
 
-# This function performs the cosine similarity function on the given tweet and each target tweet
-def cosine_similarity(vec1, vec2):
-    vec1 = np.array(vec1)
-    vec2 = np.array(vec2)
-    return np.dot(vec1, vec2) / (np.linalg.norm(vec1)*np.linalg.norm(vec2))
-
-# The final endpoint uses embedding and cosine similarity to find the top_n (defaulted at 10) tweets similar to a tweet given by ID (defaulted at 71000)
+# The final endpoint uses embedding and cosine similarity to find the top_n (defaulted at 10) tweets similar to a tweet given by ID (defaulted at 71000).
+# mode = "approximate" searches the nprobe closest lists of the IVF index instead of every tweet. It is a 503 when no index was loaded, rather than quietly
+# returning the exact results, so that a deployment without ivf_index.npz does not look like it is using the index
 @app.get("/similar_tweets/", response_model = List[Tweets])
-async def get_similar_tweets(db:db_dependency, request:Request, tweet_id: int, top_n: int = 10):
+def get_similar_tweets(db:db_dependency, request:Request, tweet_id: int, top_n: int = 10,
+                       mode: Literal["exact", "approximate"] = "exact", nprobe: int = Query(NPROBE, ge = 1)):
+    if mode == "approximate" and ivf_index is None:
+        raise HTTPException(status_code = HTTP_503_SERVICE_UNAVAILABLE,
+                            detail = f"No approximate index is loaded. Build {IVF_INDEX_PATH} with 'python ivf_index.py' and restart the app")
+    target_tweet, similar_tweets = query_cache.get_or_compute("similar_tweets", {"tweet_id": tweet_id, "top_n": top_n, "mode": mode, "nprobe": nprobe},
+                                                              lambda: find_similar_tweets(db, tweet_id, top_n, mode, nprobe))
+    # Return the similar_tweets list in the home.html format, which will appear on the web page
+    return  render_template("similar_tweets.html", {"request": request, "tweets":similar_tweets, "target_tweet": target_tweet, "title": "Similar Tweets"})
+
+# Returns the target tweet and its top_n most similar tweets, as the dictionaries made by tweet_row
+def find_similar_tweets(db, tweet_id, top_n, mode, nprobe):
     # the endpoint begins by querying the tweet that matches the ID given in the function above
-    target_tweet = db.query(models.Tweets).filter(models.Tweets.id == tweet_id).first()
+    with span("similar_tweets.fetch_target"):
+        target_tweet = db.query(models.Tweets).filter(models.Tweets.id == tweet_id).first()
     # If the tweet id does not exist, an error will be raised
     if not target_tweet:
         raise HTTPException(status_code= 404, detail = "Tweet not found")
-    
-    # Here, the target tweet is identified and begins to be formatted
-    target_vector_str = target_tweet.embedding_vector
-    # Formatting the vectors turned in to a multi line process, but the next two lines seemed to get the vector in the correct format for cosine similarity
-    target_vector_list = json.loads(target_vector_str)
-    target_vector = np.array(target_vector_list, dtype = float)
-
-    # Retrieve all of the tweets from the database
-    all_tweets = db.query(models.Tweets).all()
-    # Create an empty list for the tweet, similarity tuples
-    similarities = []
-
-    # Start iterating through all of the tweets
-    for tweet in all_tweets:
-        # Ignore the tweet with a matching ID, as it will always be the most similar to itself
-        if tweet.id != tweet_id:
-            # Perform the same formatting process on each tweet in all_tweets that was performed on the target tweet above
-            tweet_embedding_str = tweet.embedding_vector
-            tweet_embedding_list = json.loads(tweet_embedding_str)
-            tweet_embedding = np.array(tweet_embedding_list, dtype = float)
-            # Use the cosine_similarity function from above to retrieve the similarity value between the target tweet and the tweet from all_tweets
-            similarity = cosine_similarity(target_vector, tweet_embedding)
-            # append the tweet, similarity tuple to the similarities list
-            similarities.append((tweet, similarity))
-    # Same as sorting the sorted_words in the top N most frequent words, this next line of code sorts for the highest similarity values
-    similarities.sort(key=lambda x:x[1], reverse = True)
-    # similar_tweets is a list made up of the tweets and similarity values that rank the top_n closest to the target tweet
-    similar_tweets = [tweet for tweet, similarity in similarities[:top_n]]
-    # Return the similar_tweets list in the home.html format, which will appear on the web page
-    return  templates.TemplateResponse("similar_tweets.html", {"request": request, "tweets":similar_tweets, "target_tweet": target_tweet, "title": "Similar Tweets"})
-    
-    
\ No newline at end of file
+
+    # Use the vector that is already in the store. A tweet that was loaded after the store was built still has its vector read from the database
+    target_vector = vector_store.vector(tweet_id)
+    if target_vector is None:
+        with span("similar_tweets.decode"):
+            target_vector = normalize(decode_embedding(target_tweet.embedding_vector).reshape(1, -1))[0]
+
+    # Both searches return the top_n (tweet id, similarity) tuples, most similar first. The store scores every tweet with one matrix-vector product
+    if mode == "approximate":
+        with span("similar_tweets.search_approximate"):
+            matches = ivf_index.search(target_vector, top_n, nprobe = nprobe, exclude_id = tweet_id)
+    else:
+        with span("similar_tweets.search_exact"):
+            matches = vector_store.search(target_vector, top_n, exclude_id = tweet_id)
+    # Only the winning tweets are fetched from the database, and then put back in order of similarity
+    match_ids = [match_id for match_id, similarity in matches]
+    with span("similar_tweets.fetch_matches"):
+        tweets_by_id = {tweet.id: tweet for tweet in db.query(models.Tweets).filter(models.Tweets.id.in_(match_ids)).all()}
+    similar_tweets = [tweet_row(tweets_by_id[match_id]) for match_id in match_ids if match_id in tweets_by_id]
+    return tweet_row(target_tweet), similar_tweets
+
+'''
+/clusters/ lists the topic clusters that clusters.py found by running mini-batch k-means over every stored embedding, with the size and top terms of each,
+and /clusters/{cluster_id}/ pages through the tweets of one cluster, newest first. Both only read what clusters.py (and preprocessing.py, for the tweets it
+loaded since) wrote to the clusters table and tweets.cluster_id, so nothing is clustered while a request waits.
+'''
+
+# Lists every cluster, largest first
+@app.get("/clusters/")
+def get_clusters(db: db_dependency, request: Request):
+    with span("clusters.list"):
+        clusters = db.query(models.Clusters.id, models.Clusters.size, models.Clusters.top_terms).order_by(models.Clusters.size.desc(), models.Clusters.id).all()
+    return render_template("clusters.html", {"request": request, "clusters": clusters, "title": "Topic Clusters"})
+
+# Shows limit tweets of a cluster at a time. The cursor is the id of the last tweet on the current page, and the next page is read from the
+# ix_tweets_cluster_id_id index right after it
+@app.get("/clusters/{cluster_id}/")
+def get_cluster_tweets(db: db_dependency, request: Request, cluster_id: int, limit: int = Query(20, ge = 1, le = 100), cursor: Optional[int] = None):
+    with span("clusters.fetch_cluster"):
+        cluster = db.query(models.Clusters.id, models.Clusters.top_terms).filter(models.Clusters.id == cluster_id).first()
+    if not cluster:
+        raise HTTPException(status_code = 404, detail = "Cluster not found")
+    after = models.Tweets.id < cursor if cursor is not None else None
+    with span("clusters.page"):
+        tweets, next_cursor = fetch_page(db.query(models.Tweets).filter(models.Tweets.cluster_id == cluster_id), (models.Tweets.id.desc(),), after, limit,
+                                         lambda tweet: tweet.id)
+    return render_template("home.html", {"request": request, "tweets": tweets, "next_url": next_page_url(request, next_cursor),
+                                         "title": f"Cluster {cluster_id}: {', '.join(cluster.top_terms.split()[:5])}"})
+
+# Rebuilds the vector store, for example after preprocessing.py has loaded new tweets, and returns the number of tweets it now holds. New tweets are also
+# added to the IVF index, which is saved again so that the next start does not have to add them
+@app.post("/similar_tweets/refresh")
+def refresh_similar_tweets(db: db_dependency):
+    with span("vector_store.refresh"):
+        count = vector_store.refresh(db)
+    added = 0
+    if ivf_index is not None:
+        matrix, ids, rows = vector_store.snapshot()
+        added = ivf_index.add(ids, matrix)
+        if added:
+            ivf_index.save(IVF_INDEX_PATH)
+    # Cached similar tweets may have been computed from the old store
+    query_cache.clear()
+    return {"tweets": count, "added_to_index": added}
+
+# Returns the hit and miss counts of the query cache in this worker and the number of entries it holds
+@app.get("/cache/stats")
+def get_cache_stats():
+    return query_cache.stats()
+
+# Returns the request, span and database query metrics of this worker in the Prometheus text format (see metrics.py)
+@app.get("/metrics", response_class = PlainTextResponse)
+def get_metrics():
+    return PlainTextResponse(render_metrics(), media_type = "text/plain; version=0.0.4")
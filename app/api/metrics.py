@@ -0,0 +1,143 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import event
+
+'''
+The metrics in this file are collected in memory by every worker and returned in the Prometheus text format by /metrics, so a Prometheus server (or a curl
+call) can see where the time of a request goes:
+* http_request_duration_seconds: one histogram per endpoint, method and status code, recorded by the middleware in main.py
+* span_duration_seconds: one histogram per named span. main.py wraps the hot sections of each endpoint (the database fetches, the similarity search and the
+  Jinja rendering) in span("name") blocks
+* db_query_duration_seconds and db_rows_total: every query SQLAlchemy sends, timed by the event hooks instrument_engine adds to the engine. Each query is
+  labelled with the span it ran in, so the time of a span can be split into time spent in the database and time spent in Python
+
+Prometheus' own client library is not used because these few histograms and counters are all the app needs. Every uvicorn worker keeps its own numbers,
+like the query cache does.
+'''
+
+# Upper bounds (in seconds) of the histogram buckets, from 1 ms to 10 s
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# The span the current request (or thread) is in, used to label its database queries
+current_span = ContextVar("current_span", default = "none")
+
+
+# Formats labels the way the text format expects them, for example {endpoint="/home/",method="GET"}
+def _format_labels(names, values, extra = ()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+# Escapes the backslashes, quotes and line breaks in a label value
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Histogram:
+    def __init__(self, name, description, label_names = (), buckets = DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        # Maps the label values to [count per bucket (the last one is +Inf), sum of the observed values]
+        self.series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: (list(counts), total) for labels, (counts, total) in self.series.items()}
+        for label_values, (counts, total) in sorted(series.items()):
+            # Prometheus buckets are cumulative, so each one also counts every value in the buckets below it
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, label_values, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, label_values)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, label_values)} {cumulative}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, description, label_names = ()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount, *label_values):
+        with self._lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self.values)
+        for label_values, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {value}")
+        return lines
+
+
+REQUEST_DURATION = Histogram("http_request_duration_seconds", "Time taken to answer each request", ("endpoint", "method", "status"))
+SPAN_DURATION = Histogram("span_duration_seconds", "Time spent in each named section of the endpoints", ("span",))
+QUERY_DURATION = Histogram("db_query_duration_seconds", "Time taken by each database query", ("span", "operation"))
+QUERY_ROWS = Counter("db_rows_total", "Rows returned or changed by the database queries", ("span", "operation"))
+
+METRICS = (REQUEST_DURATION, SPAN_DURATION, QUERY_DURATION, QUERY_ROWS)
+
+
+# Times the block of code inside it under the given name, for example: with span("similar_tweets.search"): ...
+@contextmanager
+def span(name):
+    token = current_span.set(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        SPAN_DURATION.observe(time.perf_counter() - start, name)
+        current_span.reset(token)
+
+
+# Adds the event hooks that time every query the engine runs and count the rows it returns
+def instrument_engine(engine):
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        connection.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - connection.info["query_start"].pop()
+        # The first word of the statement (SELECT, INSERT, ...) keeps the number of label values small
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "UNKNOWN"
+        span_name = current_span.get()
+        QUERY_DURATION.observe(elapsed, span_name, operation)
+        # rowcount is -1 when the driver does not report it, for example for the server-side cursors used to stream NDJSON or for SELECTs on SQLite
+        if cursor.rowcount is not None and cursor.rowcount >= 0:
+            QUERY_ROWS.inc(cursor.rowcount, span_name, operation)
+
+    # A query that fails never reaches after_cursor_execute, so its start time is dropped here
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        connection = context.connection
+        if connection is not None and connection.info.get("query_start"):
+            connection.info["query_start"].pop()
+
+
+# Returns every metric in the Prometheus text format
+def render_metrics():
+    return "\n".join(line for metric in METRICS for line in metric.render()) + "\n"
@@ -1,19 +1,60 @@
 from ctypes.wintypes import FLOAT
-from sqlalchemy import Column, Integer, String, Date, ARRAY, FLOAT
+from sqlalchemy import Column, Computed, Index, Integer, BigInteger, String, Date, ARRAY, FLOAT, LargeBinary
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import deferred
 from database import Base
 
 # This is my Tweets class object. I had to add extend_existing as a property of the class because the table was made before the preprocessing step and 
 # is being modified within the code
 class Tweets(Base):
     __tablename__ = 'tweets'
-    __table_args__ = {'extend_existing': True}
+    __table_args__ = (Index('ix_tweets_search_vector', 'search_vector', postgresql_using = 'gin'),
+                      Index('ix_tweets_created_at_id', 'created_at', 'id'),
+                      Index('ix_tweets_source_id', 'source_id'),
+                      Index('ix_tweets_content_hash', 'content_hash'),
+                      Index('ix_tweets_cluster_id_id', 'cluster_id', 'id'),
+                      {'extend_existing': True})
 
     id = Column(Integer, primary_key= True, index = True)
     created_at = Column(Date, index = True)
     lang = Column(String, index = True)
     text = Column(String, index = True)
-    full_text = Column(String, index = True)
+    full_text = Column(String)
     sentiment = Column(String, index = True)
     sentiment_val = Column(FLOAT, index = True)
-    embedding_vector = Column(String, index = True)
+    # Raw float32 bytes, written and read with the helpers in embedding_codec.py. It is not indexed because it is never filtered or sorted on
+    embedding_vector = Column(LargeBinary)
+    # Filled by Postgres from full_text whenever a row is inserted and searched through a GIN index by /tweets_by_keyword/
+    # (added to an existing database by data/migrations/full_text_search.py)
+    # It is deferred so that it is only loaded when it is asked for, not with every tweet that is displayed
+    search_vector = deferred(Column(TSVECTOR, Computed("to_tsvector('english', coalesce(full_text, ''))", persisted = True)))
+    # The tweet's id in the source file and a hash of full_text, used by preprocessing.py to skip tweets that are already loaded
+    # (added to an existing database by data/migrations/source_ids.py)
+    source_id = Column(String)
+    content_hash = Column(String)
+    # The topic cluster of the tweet, written by app/api/clusters.py and by preprocessing.py for the tweets it loads afterwards
+    # (added to an existing database by data/migrations/clusters.py)
+    cluster_id = Column(Integer)
+
+# The number of times each word of the cleaned text was used on each day. preprocessing.py adds to these counts as it loads tweets, and /most_frequent/
+# adds them up instead of splitting every tweet on each request
+class TermCounts(Base):
+    __tablename__ = 'term_counts'
+    __table_args__ = {'extend_existing': True}
+
+    day = Column(Date, primary_key = True)
+    term = Column(String, primary_key = True)
+    count = Column(BigInteger, nullable = False)
+
+# The topic clusters trained by app/api/clusters.py. size is the number of tweets in the cluster and top_terms holds its most distinctive words, separated
+# by spaces. The centroid (raw float32 bytes, like embedding_vector) is only read by preprocessing.py, so it is deferred. generation goes up by one every
+# time the clusters are retrained
+class Clusters(Base):
+    __tablename__ = 'clusters'
+    __table_args__ = {'extend_existing': True}
 
+    id = Column(Integer, primary_key = True)
+    size = Column(BigInteger, nullable = False)
+    top_terms = Column(String, nullable = False)
+    centroid = deferred(Column(LargeBinary, nullable = False))
+    generation = Column(BigInteger, nullable = False)
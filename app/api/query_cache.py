@@ -0,0 +1,232 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError, ProgrammingError
+
+'''
+QueryCache keeps the results of /most_frequent/, /similar_tweets/ and /tweets_by_date/ so that repeated calls with the same parameters do not run the same
+queries again. Each entry is keyed by the endpoint, its normalized parameters and the current dataset version. preprocessing.py adds one to the version in
+the dataset_version table every time it loads a chunk of tweets, so new data gives every request a new key and the old entries are never read again. They
+are removed by the size limit (least recently used first) or their time to live, whichever comes first.
+
+There are two backends. MemoryBackend keeps the entries in the process, which is the fastest but means that every uvicorn worker has its own cache.
+SqliteBackend keeps them in a SQLite file, so every worker on the same machine shares the same entries. The values are stored as JSON rather than pickled,
+since every cached result is a list of plain values and dictionaries, and reading a shared file should never run code that another process wrote. Dates
+come back as their ISO strings, which the templates show the same way. A lookup only reads the file, apart from moving an entry's last_used time forward
+once in a while, so cache hits do not wait for SQLite's write lock. If the file cannot be read or written (it is locked for longer than the timeout, or the
+disk is full), the lookup counts as a miss and the result is not stored, so the endpoint still works without the cache. Counting and clearing the entries
+fall back the same way. While the dataset version cannot be read, every request skips the cache.
+'''
+
+
+class MemoryBackend:
+    def __init__(self, max_entries = 1024):
+        self.max_entries = max_entries
+        # Maps a key to (expires_at, value), ordered from least to most recently used
+        self.entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self.entries[key] = (time.time() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last = False)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+
+class SqliteBackend:
+    # last_used is only written when it is more than touch_interval seconds old. The least recently used order is then only accurate to touch_interval, which
+    # is plenty for choosing what to remove
+    def __init__(self, path, max_entries = 1024, touch_interval = 30.0):
+        self.path = path
+        self.max_entries = max_entries
+        self.touch_interval = touch_interval
+        # SQLite connections cannot be shared between threads, so each worker thread opens its own
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS query_cache (
+                    key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL, last_used REAL NOT NULL
+                )
+            """)
+            connection.execute("CREATE INDEX IF NOT EXISTS ix_query_cache_last_used ON query_cache (last_used)")
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout = 5)
+            # Write-ahead logging lets the workers read while one of them writes
+            connection.execute("PRAGMA journal_mode = WAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, key):
+        now = time.time()
+        try:
+            record = self._connection().execute("SELECT expires_at, last_used, value FROM query_cache WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error:
+            return None
+        # Expired entries are left for set() to remove, so that a lookup does not have to write
+        if record is None or record[0] <= now:
+            return None
+        if now - record[1] >= self.touch_interval:
+            try:
+                with self._connection() as connection:
+                    connection.execute("UPDATE query_cache SET last_used = ? WHERE key = ?", (now, key))
+            # The entry is still returned, it only keeps its older last_used
+            except sqlite3.Error:
+                pass
+        try:
+            return record[0], json.loads(record[2])
+        # A row that cannot be decoded (cut short, or written by an older version that pickled its values) is removed and counted as a miss
+        except ValueError:
+            try:
+                with self._connection() as connection:
+                    connection.execute("DELETE FROM query_cache WHERE key = ?", (key,))
+            except sqlite3.Error:
+                pass
+            return None
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        try:
+            with self._connection() as connection:
+                connection.execute("INSERT OR REPLACE INTO query_cache (key, value, expires_at, last_used) VALUES (?, ?, ?, ?)",
+                                   (key, json.dumps(value, default = str), now + ttl, now))
+                connection.execute("DELETE FROM query_cache WHERE expires_at <= ?", (now,))
+                # Remove the least recently used entries once the file holds more than max_entries
+                connection.execute("""
+                    DELETE FROM query_cache WHERE key IN (
+                        SELECT key FROM query_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                    )
+                """, (self.max_entries,))
+        # The value was already computed, so the request is answered anyway and only the caching is skipped
+        except sqlite3.Error:
+            pass
+
+    # Counts the file as empty when it cannot be read, so that /cache/stats still answers
+    def __len__(self):
+        try:
+            return self._connection().execute("SELECT count(*) FROM query_cache").fetchone()[0]
+        except sqlite3.Error:
+            return 0
+
+    # The entries that could not be removed belong to the same dataset version and expire with their time to live, so a failure does not fail the request
+    # that asked for the clear
+    def clear(self):
+        try:
+            with self._connection() as connection:
+                connection.execute("DELETE FROM query_cache")
+        except sqlite3.Error:
+            pass
+
+
+# Reads the dataset version from the database, at most once every check_interval seconds. get() returns None while the version is unknown, which makes
+# QueryCache skip the cache, since an entry could then belong to any version of the data
+class DatasetVersion:
+    def __init__(self, engine, check_interval = 5.0):
+        self.engine = engine
+        self.check_interval = check_interval
+        self.version = None
+        self.checked_at = 0.0
+
+    def get(self):
+        now = time.monotonic()
+        if now - self.checked_at >= self.check_interval:
+            try:
+                with self.engine.connect() as connection:
+                    self.version = connection.execute(text("SELECT coalesce(max(version), 0) FROM dataset_version")).scalar()
+            # A database that was loaded before dataset_version existed keeps version 0 until preprocessing.py creates the table
+            except ProgrammingError:
+                self.version = 0
+            # When the database cannot be reached, the last version that was read is kept. Nothing can be loaded into the database while it is down, so
+            # that version is still current. Falling back to 0 instead would serve entries cached before earlier loads
+            except DBAPIError:
+                pass
+            self.checked_at = now
+        return self.version
+
+
+class QueryCache:
+    def __init__(self, backend, version, ttl = 300):
+        self.backend = backend
+        self.version = version
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    # Builds the key from the endpoint, the parameters (sorted by name, so their order in the URL does not matter) and the dataset version
+    def key(self, endpoint, params, version):
+        normalized = json.dumps([endpoint, version, sorted(params.items())], default = str)
+        return hashlib.sha256(normalized.encode()).hexdigest()
+
+    # Returns the cached value for the endpoint and parameters, or calls compute, caches what it returns and returns it
+    def get_or_compute(self, endpoint, params, compute):
+        if self.backend is None:
+            return compute()
+        version = self.version.get()
+        # The dataset version has not been read yet, so neither a hit nor a stored value could be matched to the data it came from
+        if version is None:
+            return compute()
+        key = self.key(endpoint, params, version)
+        entry = self.backend.get(key)
+        with self._lock:
+            if entry is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if entry is not None:
+            return entry[1]
+        value = compute()
+        self.backend.set(key, value, self.ttl)
+        return value
+
+    # Removes every entry, for example after the vector store behind /similar_tweets/ has been rebuilt
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / requests if requests else 0.0,
+                "entries": len(self.backend) if self.backend is not None else 0}
+
+
+# Builds the cache from the QUERY_CACHE_* environment variables. QUERY_CACHE_BACKEND is "memory" (the default), "sqlite" or "none"
+def cache_from_environment(engine):
+    kind = os.environ.get("QUERY_CACHE_BACKEND", "memory")
+    max_entries = int(os.environ.get("QUERY_CACHE_SIZE", 1024))
+    ttl = float(os.environ.get("QUERY_CACHE_TTL", 300))
+    if kind == "sqlite":
+        # A hit only moves the entry's last_used forward if it is older than a tenth of the time to live
+        backend = SqliteBackend(os.environ.get("QUERY_CACHE_PATH", "query_cache.sqlite3"), max_entries, touch_interval = ttl / 10)
+    elif kind == "none":
+        backend = None
+    else:
+        backend = MemoryBackend(max_entries)
+    version = DatasetVersion(engine, float(os.environ.get("QUERY_CACHE_VERSION_CHECK", 5)))
+    return QueryCache(backend, version, ttl = ttl)
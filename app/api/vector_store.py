@@ -0,0 +1,86 @@
+import threading
+import numpy as np
+import models
+from embedding_codec import decode_embeddings
+from kmeans import normalize
+
+'''
+The VectorStore keeps every tweet's embedding in memory as one contiguous float32 matrix. Each row is L2 normalized when the store is built, so the cosine
+similarity between a tweet and every other tweet is a single matrix-vector product, and the top_n rows are picked with np.argpartition instead of sorting the
+whole table. The store is built once when the app starts and can be rebuilt on demand after new tweets have been loaded.
+'''
+
+# Number of rows pulled from the database at a time while the store is being built
+LOAD_BATCH_SIZE = 5000
+
+
+class VectorStore:
+    def __init__(self):
+        # (matrix, ids, rows), where rows maps a tweet id to its row in the matrix. The three are kept in one tuple that is replaced as a whole, so a search
+        # that reads it once never sees a matrix and an id map that do not belong together, even while another thread rebuilds the store
+        self._state = (np.empty((0, 0), dtype = np.float32), np.empty(0, dtype = np.int64), {})
+        # Only one rebuild runs at a time, while searches keep using the previous matrix until the new one is swapped in
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._state[1])
+
+    # Returns the (matrix, ids, rows) of the store at this moment. Callers that need more than one of them should read them together through this
+    def snapshot(self):
+        return self._state
+
+    @property
+    def matrix(self):
+        return self._state[0]
+
+    @property
+    def ids(self):
+        return self._state[1]
+
+    @property
+    def rows(self):
+        return self._state[2]
+
+    # Loads the id and embedding of every tweet and swaps in the new matrix
+    def refresh(self, db):
+        with self._lock:
+            ids = []
+            vectors = []
+            query = db.query(models.Tweets.id, models.Tweets.embedding_vector).filter(models.Tweets.embedding_vector.isnot(None))
+            for tweet_id, embedding_vector in query.yield_per(LOAD_BATCH_SIZE):
+                ids.append(tweet_id)
+                vectors.append(bytes(embedding_vector))
+            # The stored float32 bytes are joined and read as one matrix, without parsing each value
+            matrix = normalize(decode_embeddings(vectors))
+            ids = np.asarray(ids, dtype = np.int64)
+            # A single assignment swaps in the new state, so the matrix, ids and id map always change together
+            self._state = (matrix, ids, {int(tweet_id): row for row, tweet_id in enumerate(ids)})
+        return len(ids)
+
+    # Returns the normalized vector of a tweet that is in the store, or None if the tweet was added after the store was built
+    def vector(self, tweet_id):
+        matrix, ids, rows = self._state
+        row = rows.get(tweet_id)
+        return None if row is None else matrix[row]
+
+    # Returns a list of (tweet_id, similarity) tuples for the top_n tweets closest to the query vector, most similar first
+    def search(self, query_vector, top_n = 10, exclude_id = None):
+        matrix, ids, rows = self._state
+        if len(ids) == 0 or top_n <= 0:
+            return []
+        query_vector = normalize(np.asarray(query_vector, dtype = np.float32).reshape(1, -1))[0]
+        # Because every row has a length of 1, the dot product is the cosine similarity
+        scores = matrix @ query_vector
+        # The target tweet is always the most similar to itself, so it is left out
+        if exclude_id in rows:
+            scores[rows[exclude_id]] = -np.inf
+            available = len(ids) - 1
+        else:
+            available = len(ids)
+        top_n = min(top_n, available)
+        if top_n <= 0:
+            return []
+        # argpartition finds the top_n rows without sorting the rest of the table, then only those rows are sorted
+        top_rows = np.argpartition(-scores, top_n - 1)[:top_n]
+        top_rows = top_rows[np.argsort(-scores[top_rows])]
+        return [(int(ids[row]), float(scores[row])) for row in top_rows]
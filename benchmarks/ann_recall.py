@@ -0,0 +1,90 @@
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../app/api'))
+from ivf_index import IVFIndex, default_n_lists
+
+'''
+This benchmark compares the approximate IVF search with the exact scan used by /similar_tweets/. For every nprobe value it runs the same queries through both
+searches and reports recall@k (the share of the exact top k that the IVF search also found) and the average latency of each search.
+
+By default it uses synthetic embeddings that are grouped around random topics, which behaves much more like real sentence embeddings than uniform noise.
+With --from-db it uses the embeddings in the tweets database instead (run it from the repository root so that app/api can find its templates and models).
+
+Example: python benchmarks/ann_recall.py --rows 100000 --k 10 --nprobe 1 2 4 8 16 32
+'''
+
+
+# Builds rows of L2 normalized vectors scattered around n_topics random directions
+def synthetic_embeddings(n_rows, dim = 768, n_topics = 200, spread = 0.6, seed = 0):
+    rng = np.random.default_rng(seed)
+    topics = rng.normal(size = (n_topics, dim)).astype(np.float32)
+    matrix = topics[rng.integers(0, n_topics, n_rows)] + spread * rng.normal(size = (n_rows, dim)).astype(np.float32)
+    matrix /= np.linalg.norm(matrix, axis = 1, keepdims = True)
+    return np.arange(1, n_rows + 1, dtype = np.int64), matrix
+
+
+# Loads the ids and normalized embeddings from the database through the same VectorStore the app uses
+def database_embeddings():
+    from database import SessionLocal
+    from vector_store import VectorStore
+    store = VectorStore()
+    db = SessionLocal()
+    try:
+        store.refresh(db)
+    finally:
+        db.close()
+    matrix, ids, rows = store.snapshot()
+    return ids, matrix
+
+
+# The exact scan, the same matrix-vector product and argpartition that VectorStore.search runs
+def exact_search(matrix, ids, query_vector, k, exclude_row):
+    scores = matrix @ query_vector
+    scores[exclude_row] = -np.inf
+    top_rows = np.argpartition(-scores, k - 1)[:k]
+    return ids[top_rows[np.argsort(-scores[top_rows])]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "recall@k and latency of the IVF index compared with the exact scan")
+    parser.add_argument("--rows", type = int, default = 50000, help = "Number of synthetic embeddings")
+    parser.add_argument("--from-db", action = "store_true", help = "Use the embeddings in the tweets database instead of synthetic ones")
+    parser.add_argument("--queries", type = int, default = 200, help = "Number of queries")
+    parser.add_argument("--k", type = int, default = 10, help = "Number of neighbours returned per query")
+    parser.add_argument("--n-lists", type = int, default = None, help = "Number of IVF lists (defaults to about 4 * sqrt(rows))")
+    parser.add_argument("--nprobe", type = int, nargs = "+", default = [1, 2, 4, 8, 16, 32], help = "nprobe values to try")
+    parser.add_argument("--seed", type = int, default = 0)
+    args = parser.parse_args()
+
+    ids, matrix = database_embeddings() if args.from_db else synthetic_embeddings(args.rows, seed = args.seed)
+    n_lists = args.n_lists or default_n_lists(len(ids))
+    print(f"{len(ids)} embeddings, {n_lists} lists, k = {args.k}, {args.queries} queries")
+
+    start = time.perf_counter()
+    index = IVFIndex.build(ids, matrix, n_lists = n_lists, seed = args.seed)
+    print(f"Index built in {time.perf_counter() - start:.1f} s")
+
+    rng = np.random.default_rng(args.seed + 1)
+    query_rows = rng.choice(len(ids), min(args.queries, len(ids)), replace = False)
+
+    # The exact results are the ground truth that recall is measured against
+    start = time.perf_counter()
+    truth = [set(exact_search(matrix, ids, matrix[row], args.k, row).tolist()) for row in query_rows]
+    exact_ms = (time.perf_counter() - start) * 1000 / len(query_rows)
+    print(f"{'search':<16} {'recall@' + str(args.k):>10} {'ms/query':>10} {'speedup':>10}")
+    print(f"{'exact':<16} {1.0:>10.3f} {exact_ms:>10.3f} {1.0:>10.1f}")
+
+    for nprobe in args.nprobe:
+        start = time.perf_counter()
+        results = [index.search(matrix[row], args.k, nprobe = nprobe, exclude_id = int(ids[row])) for row in query_rows]
+        ivf_ms = (time.perf_counter() - start) * 1000 / len(query_rows)
+        recall = np.mean([len(expected & {tweet_id for tweet_id, score in found}) / args.k for expected, found in zip(truth, results)])
+        print(f"{'ivf nprobe=' + str(nprobe):<16} {recall:>10.3f} {ivf_ms:>10.3f} {exact_ms / ivf_ms:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+import argparse
+import asyncio
+import time
+import httpx
+import numpy as np
+
+'''
+This benchmark measures how a running server handles concurrent clients. For every concurrency level it starts that many clients, which send requests to
+the given paths back to back for a fixed number of seconds, and reports the requests per second and the p50 / p95 latency.
+
+To compare before and after a change, start the server on each version (uvicorn main:app from app/api) and run the same command against it, for example:
+python benchmarks/concurrency.py --paths "/home/" "/tweets_by_date/?start_date=2018-01-01&end_date=2018-01-10" --levels 1 10 100
+'''
+
+
+async def client(http, base_url, paths, deadline, latencies, errors):
+    request_number = 0
+    while time.perf_counter() < deadline:
+        path = paths[request_number % len(paths)]
+        request_number += 1
+        start = time.perf_counter()
+        try:
+            response = await http.get(base_url + path)
+            response.raise_for_status()
+        except httpx.HTTPError:
+            errors.append(path)
+            continue
+        latencies.append(time.perf_counter() - start)
+
+
+async def run_level(base_url, paths, concurrency, seconds):
+    latencies = []
+    errors = []
+    limits = httpx.Limits(max_connections = concurrency, max_keepalive_connections = concurrency)
+    async with httpx.AsyncClient(limits = limits, timeout = 60) as http:
+        start = time.perf_counter()
+        deadline = start + seconds
+        await asyncio.gather(*(client(http, base_url, paths, deadline, latencies, errors) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return latencies, errors, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Throughput and latency of a running server at several concurrency levels")
+    parser.add_argument("--base-url", default = "http://127.0.0.1:8000")
+    parser.add_argument("--paths", nargs = "+", default = ["/home/"], help = "Paths that every client requests in turn")
+    parser.add_argument("--levels", type = int, nargs = "+", default = [1, 10, 100], help = "Numbers of concurrent clients")
+    parser.add_argument("--seconds", type = float, default = 10, help = "How long each level runs")
+    args = parser.parse_args()
+
+    print(f"{'clients':>8} {'requests':>10} {'errors':>8} {'req/sec':>10} {'p50 ms':>10} {'p95 ms':>10}")
+    for concurrency in args.levels:
+        latencies, errors, elapsed = asyncio.run(run_level(args.base_url, args.paths, concurrency, args.seconds))
+        p50, p95 = (np.percentile(latencies, [50, 95]) * 1000) if latencies else (float('nan'), float('nan'))
+        print(f"{concurrency:>8} {len(latencies):>10} {len(errors):>8} {len(latencies) / elapsed:>10.1f} {p50:>10.1f} {p95:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
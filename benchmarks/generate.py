@@ -0,0 +1,85 @@
+import argparse
+import json
+import os
+from datetime import datetime, timedelta, timezone
+import numpy as np
+
+'''
+This file generates synthetic tweets in the same shape as tweets.jl (one {"document": {...}} object per line with id_str, created_at, lang, text and
+full_text) so that the benchmarks can run at sizes the real archive does not reach, such as 100k or 1M tweets. Every tweet also gets a random 768 value
+embedding, written to embeddings.npy in the same order, so loading the fixture does not have to run BERT.
+
+The words are drawn from a Zipf distribution over a fixed vocabulary, which gives /most_frequent/ and /tweets_by_keyword/ a realistic mix of very common and
+rare words, and a few stop words and an @mention are mixed in so that the cleaned text differs from full_text like it does for real tweets. The output
+only depends on --rows and --seed, so two runs with the same arguments produce the same files.
+
+Example: python benchmarks/generate.py --rows 100000 --out benchmarks/data/100k
+'''
+
+EMBEDDING_DIM = 768
+
+# Words that the fixture removes when it builds the cleaned text, standing in for SpaCy's stop words
+STOP_WORDS = ("the", "a", "to", "and", "of", "in", "is", "it", "for", "on", "with", "this", "that", "i", "you")
+
+LANGUAGES = ("en", "en", "en", "en", "de", "es", "fr")
+
+# First and last day of the generated tweets
+START_DATE = datetime(2017, 1, 1, tzinfo = timezone.utc)
+DAYS = 730
+
+# Number of tweets generated and written at a time
+CHUNK_SIZE = 10000
+
+
+# Builds a vocabulary of made-up, purely alphabetic words
+def make_vocabulary(rng, size = 20000):
+    letters = np.array(list("abcdefghijklmnopqrstuvwxyz"))
+    lengths = rng.integers(3, 10, size)
+    words = {"".join(rng.choice(letters, length)) for length in lengths}
+    # Shuffled so that the most common words are not simply the first ones in alphabetical order
+    return list(rng.permutation(sorted(words - set(STOP_WORDS))))
+
+
+def generate(out_dir, rows, seed = 0):
+    os.makedirs(out_dir, exist_ok = True)
+    rng = np.random.default_rng(seed)
+    vocabulary = np.array(make_vocabulary(rng))
+    # Zipf weights, so the first words of the vocabulary are used far more than the last ones
+    weights = 1.0 / np.arange(1, len(vocabulary) + 1)
+    weights /= weights.sum()
+
+    # open_memmap writes the embeddings straight to disk, so 1M rows (about 3 GB) never have to fit in memory at once
+    embeddings = np.lib.format.open_memmap(os.path.join(out_dir, "embeddings.npy"), mode = "w+", dtype = np.float32, shape = (rows, EMBEDDING_DIM))
+    with open(os.path.join(out_dir, "tweets.jl"), "w", encoding = "utf-8") as file:
+        for start in range(0, rows, CHUNK_SIZE):
+            count = min(CHUNK_SIZE, rows - start)
+            embeddings[start:start + count] = rng.standard_normal((count, EMBEDDING_DIM), dtype = np.float32)
+            seconds = rng.integers(0, DAYS * 86400, count)
+            lengths = rng.integers(4, 25, count)
+            # The words of the whole chunk are drawn at once and then split into tweets
+            chunk_words = rng.choice(vocabulary, lengths.sum(), p = weights).tolist()
+            boundaries = np.concatenate([[0], np.cumsum(lengths)])
+            stop_words = rng.choice(STOP_WORDS, (count, 3)).tolist()
+            stop_positions = rng.random((count, 3))
+            lines = []
+            for row in range(count):
+                words = chunk_words[boundaries[row]:boundaries[row + 1]]
+                for stop_word, position in zip(stop_words[row], stop_positions[row]):
+                    words.insert(int(position * len(words)), stop_word)
+                full_text = f"@user{rng.integers(1000)} " + " ".join(words)
+                created_at = (START_DATE + timedelta(seconds = int(seconds[row]))).strftime("%a %b %d %H:%M:%S %z %Y")
+                document = {"id_str": str(start + row + 1), "created_at": created_at, "lang": str(rng.choice(LANGUAGES)), "text": full_text,
+                            "full_text": full_text}
+                lines.append(json.dumps({"document": document}) + "\n")
+            file.writelines(lines)
+            print(f"Generated {start + count} of {rows} tweets")
+    embeddings.flush()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Generate tweets.jl-shaped synthetic tweets with random embeddings")
+    parser.add_argument("--rows", type = int, default = 10000, help = "Number of tweets, for example 10000, 100000 or 1000000")
+    parser.add_argument("--out", default = None, help = "Output folder (defaults to benchmarks/data/<rows>)")
+    parser.add_argument("--seed", type = int, default = 0)
+    args = parser.parse_args()
+    generate(args.out or os.path.join(os.path.dirname(__file__), "data", str(args.rows)), args.rows, args.seed)
@@ -4,20 +4,75 @@ This SQL code is used to create a table called tweets, which will house the data
 
 CREATE TABLE tweets (
     id SERIAL PRIMARY KEY,
-    created_at TEXT,
+    --A DATE, so that /tweets_by_date/ and the keyset cursors can compare it with dates. Tables created with TEXT can be converted with
+    --data/migrations/created_at_date.py
+    created_at DATE,
     lang TEXT,
     text TEXT,
     full_text TEXT,
     sentiment TEXT,
     sentiment_val FLOAT,
-    embedding_vector TEXT
+    --Raw float32 bytes, see app/api/embedding_codec.py. Tables created with TEXT can be converted with data/migrations/embedding_bytea.py
+    embedding_vector BYTEA,
+    --Filled from full_text by Postgres and searched by /tweets_by_keyword/. Existing tables can be updated with data/migrations/full_text_search.py
+    search_vector TSVECTOR GENERATED ALWAYS AS (to_tsvector('english', coalesce(full_text, ''))) STORED,
+    --The tweet's id in the source file and a SHA-256 hash of full_text, which the incremental mode of preprocessing.py uses to skip tweets that are
+    --already loaded. Existing tables can be updated with data/migrations/source_ids.py
+    source_id TEXT,
+    content_hash TEXT,
+    --The topic cluster of the tweet, written by app/api/clusters.py and by preprocessing.py for new tweets. Existing tables can be updated with
+    --data/migrations/clusters.py
+    cluster_id INTEGER
 );
 
-TRUNCATE TABLE tweets;
+CREATE INDEX ix_tweets_search_vector ON tweets USING GIN (search_vector);
+--Used by the keyset pagination of /home/ and /tweets_by_date/ (data/migrations/keyset_index.py adds it to an existing table)
+CREATE INDEX ix_tweets_created_at_id ON tweets (created_at, id);
+CREATE INDEX ix_tweets_source_id ON tweets (source_id);
+CREATE INDEX ix_tweets_content_hash ON tweets (content_hash);
+--Used by /clusters/{cluster_id}/ to page through the tweets of one cluster
+CREATE INDEX ix_tweets_cluster_id_id ON tweets (cluster_id, id);
+
+--Keeps the byte offset and row count of the last chunk loaded by preprocessing.py so that a crashed run can resume (created by the loader if missing)
+CREATE TABLE IF NOT EXISTS ingest_checkpoint (
+    source TEXT PRIMARY KEY,
+    file_offset BIGINT NOT NULL,
+    row_count BIGINT NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT now()
+);
+
+--The number of times each word of the cleaned text was used on each day, kept up to date by preprocessing.py and read by /most_frequent/
+--(created by the loader if missing, and filled for an existing database by data/migrations/term_counts.py)
+CREATE TABLE IF NOT EXISTS term_counts (
+    day DATE NOT NULL,
+    term TEXT NOT NULL,
+    count BIGINT NOT NULL,
+    PRIMARY KEY (day, term)
+);
+
+--A single row whose version goes up every time preprocessing.py loads a chunk of tweets. The API's query cache includes it in its keys
+--(created by the loader if missing)
+CREATE TABLE IF NOT EXISTS dataset_version (
+    id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT now()
+);
+INSERT INTO dataset_version (id) VALUES (1) ON CONFLICT (id) DO NOTHING;
+
+--The topic clusters trained by app/api/clusters.py: each cluster's size, top terms and centroid (raw float32 bytes, like embedding_vector). Every
+--training run saves a new generation, which preprocessing.py checks so that it never assigns tweets with centroids that were replaced
+--(the same statement as CREATE_CLUSTERS_TABLE in app/api/clusters.py, which the loader, data/migrations/clusters.py and the benchmark fixture run)
+CREATE TABLE IF NOT EXISTS clusters (
+    id INTEGER PRIMARY KEY,
+    size BIGINT NOT NULL DEFAULT 0,
+    top_terms TEXT NOT NULL DEFAULT '',
+    centroid BYTEA NOT NULL,
+    generation BIGINT NOT NULL DEFAULT 0
+);
+
+--Clearing the checkpoint, the term counts and the clusters along with the tweets makes the next preprocessing run start from the beginning of tweets.jl
+TRUNCATE TABLE tweets, ingest_checkpoint, term_counts, clusters;
 
---Alter the created_at column type to DATE
-ALTER TABLE tweets
-ALTER COLUMN embedding_vector TYPE TEXT
 
 --Check values in tweets
 SELECT * FROM tweets;
@@ -0,0 +1,45 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from database import connect
+# Inserted ahead of this folder, so that "clusters" is app/api/clusters.py rather than this file
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../app/api'))
+from clusters import CREATE_CLUSTERS_TABLE
+
+'''
+This migration adds the cluster_id column that app/api/clusters.py writes the topic cluster of every tweet to, the clusters table that keeps each cluster's
+centroid, size and top terms, and an index on (cluster_id, id) so that /clusters/{cluster_id}/ can page through a cluster without scanning the table.
+A clusters table created before it had a generation column (which preprocessing.py checks to notice that the clusters were retrained) is given one.
+
+The columns are left empty. Train the clusters afterwards from the app/api folder with: python clusters.py
+
+Run it from the data folder with: python migrations/clusters.py
+'''
+
+ADD_COLUMN = "ALTER TABLE tweets ADD COLUMN IF NOT EXISTS cluster_id INTEGER"
+
+ADD_GENERATION = "ALTER TABLE clusters ADD COLUMN IF NOT EXISTS generation BIGINT NOT NULL DEFAULT 0"
+
+CREATE_INDEX = "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_tweets_cluster_id_id ON tweets (cluster_id, id)"
+
+
+def migrate(connection):
+    with connection.cursor() as cursor:
+        cursor.execute(ADD_COLUMN)
+        cursor.execute(CREATE_CLUSTERS_TABLE)
+        cursor.execute(ADD_GENERATION)
+    connection.commit()
+    # CONCURRENTLY cannot run inside a transaction, so the index is built in autocommit mode without blocking inserts
+    connection.autocommit = True
+    with connection.cursor() as cursor:
+        cursor.execute(CREATE_INDEX)
+    print("tweets.cluster_id, its index and the clusters table are ready")
+
+
+if __name__ == "__main__":
+    connection = connect()
+    try:
+        migrate(connection)
+    finally:
+        connection.close()
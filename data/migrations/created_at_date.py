@@ -0,0 +1,39 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from database import connect
+
+'''
+This migration converts the created_at column of the tweets table from TEXT to DATE. The API's model declares created_at as a Date, so psycopg2 sends the
+dates of /tweets_by_date/ and of the keyset cursors as dates, and Postgres cannot compare those with a TEXT column ("operator does not exist: text >= date").
+preprocessing.py has always written the dates as YYYY-MM-DD, so every value converts directly.
+
+The conversion rewrites the table and rebuilds its indexes (including ix_tweets_created_at_id), and the table is locked while it runs, so it should be run
+while the API and preprocessing.py are stopped.
+
+Run it from the data folder with: python migrations/created_at_date.py
+Running it again on a table that has already been converted does nothing.
+'''
+
+CONVERT_COLUMN = "ALTER TABLE tweets ALTER COLUMN created_at TYPE DATE USING created_at::date"
+
+
+def migrate(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT data_type FROM information_schema.columns WHERE table_name = 'tweets' AND column_name = 'created_at'")
+        record = cursor.fetchone()
+        if record and record[0] == 'date':
+            print("created_at is already stored as a date")
+            return
+        cursor.execute(CONVERT_COLUMN)
+    connection.commit()
+    print("tweets.created_at is now a date")
+
+
+if __name__ == "__main__":
+    connection = connect()
+    try:
+        migrate(connection)
+    finally:
+        connection.close()
@@ -0,0 +1,92 @@
+import argparse
+import json
+import os
+import sys
+from psycopg2.extras import execute_values
+
+# data/database.py is imported before app/api is added to the path, since app/api has a database.py of its own
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from database import connect
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../app/api'))
+from embedding_codec import encode_embedding
+
+'''
+This migration converts the embedding_vector column of the tweets table from the text of a Python list (about 15 KB per row) into raw float32 bytes in a
+bytea column (3,072 bytes per row). The converted values are written to a temporary embedding_bytes column in batches, with one commit per batch, so the
+migration can be stopped and started again without losing work. Once every row has been converted, the text column (and any index on it) is dropped and
+embedding_bytes is renamed to embedding_vector.
+
+Run it from the data folder with: python migrations/embedding_bytea.py
+Running it again on a table that has already been converted does nothing.
+'''
+
+# Number of rows converted in each transaction
+BATCH_SIZE = 2000
+
+
+# Returns the type of the embedding_vector column, for example 'text' or 'bytea'
+def column_type(cursor, column):
+    cursor.execute("SELECT data_type FROM information_schema.columns WHERE table_name = 'tweets' AND column_name = %s", (column,))
+    record = cursor.fetchone()
+    return record[0] if record else None
+
+
+def migrate(connection, batch_size = BATCH_SIZE, vacuum = False):
+    with connection.cursor() as cursor:
+        if column_type(cursor, 'embedding_vector') == 'bytea':
+            print("embedding_vector is already stored as bytea")
+            return
+        cursor.execute("ALTER TABLE tweets ADD COLUMN IF NOT EXISTS embedding_bytes BYTEA")
+        connection.commit()
+
+        # The batches walk the primary key from the first row that still has to be converted, each one starting right after the last id of the one
+        # before it. Filtering on embedding_bytes IS NULL alone would make every batch step over all of the rows converted so far. A run that was stopped
+        # starts again from the first unconverted row
+        cursor.execute("SELECT min(id) - 1 FROM tweets WHERE embedding_bytes IS NULL AND embedding_vector IS NOT NULL")
+        last_id = cursor.fetchone()[0]
+        converted = 0
+        while last_id is not None:
+            cursor.execute("""
+                SELECT id, embedding_vector FROM tweets
+                WHERE id > %s AND embedding_bytes IS NULL AND embedding_vector IS NOT NULL
+                ORDER BY id LIMIT %s
+            """, (last_id, batch_size))
+            records = cursor.fetchall()
+            if not records:
+                break
+            last_id = records[-1][0]
+            values = [(tweet_id, encode_embedding(json.loads(embedding_vector))) for tweet_id, embedding_vector in records]
+            execute_values(cursor, """
+                UPDATE tweets SET embedding_bytes = converted.embedding_bytes
+                FROM (VALUES %s) AS converted (id, embedding_bytes)
+                WHERE tweets.id = converted.id
+            """, values, page_size = batch_size)
+            connection.commit()
+            converted += len(records)
+            print(f"Converted {converted} rows")
+
+        # Swap the columns. Dropping the text column also drops any index that was built on it
+        cursor.execute("ALTER TABLE tweets DROP COLUMN embedding_vector")
+        cursor.execute("ALTER TABLE tweets RENAME COLUMN embedding_bytes TO embedding_vector")
+        connection.commit()
+        print("embedding_vector is now stored as bytea")
+
+    # The space taken by the old text values is only given back to the operating system after a VACUUM FULL, which locks the table while it runs
+    if vacuum:
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute("VACUUM FULL ANALYZE tweets")
+        print("Vacuumed tweets")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Convert tweets.embedding_vector from JSON text to float32 bytea")
+    parser.add_argument("--batch-size", type = int, default = BATCH_SIZE, help = "Number of rows converted in each transaction")
+    parser.add_argument("--vacuum", action = "store_true", help = "Run VACUUM FULL on the tweets table afterwards to reclaim the space")
+    args = parser.parse_args()
+
+    connection = connect()
+    try:
+        migrate(connection, batch_size = args.batch_size, vacuum = args.vacuum)
+    finally:
+        connection.close()
@@ -0,0 +1,42 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from database import connect
+
+'''
+This migration adds full text search to the tweets table for /tweets_by_keyword/. search_vector is a generated tsvector column, so Postgres fills it from
+full_text whenever a row is inserted (including every row preprocessing.py loads) and it never has to be written by hand. The GIN index on it lets a keyword
+search find the matching rows directly instead of scanning the table with LIKE '%keyword%', which the btree index on full_text cannot serve. That btree index
+is dropped, since nothing filters full_text by equality or range and it only slows down inserts.
+
+Adding the generated column rewrites the table once, which can take a while on a large table.
+
+Run it from the data folder with: python migrations/full_text_search.py
+'''
+
+ADD_SEARCH_VECTOR = """
+ALTER TABLE tweets ADD COLUMN IF NOT EXISTS search_vector tsvector
+GENERATED ALWAYS AS (to_tsvector('english', coalesce(full_text, ''))) STORED
+"""
+
+CREATE_SEARCH_INDEX = "CREATE INDEX IF NOT EXISTS ix_tweets_search_vector ON tweets USING GIN (search_vector)"
+
+DROP_FULL_TEXT_INDEX = "DROP INDEX IF EXISTS ix_tweets_full_text"
+
+
+def migrate(connection):
+    with connection.cursor() as cursor:
+        cursor.execute(ADD_SEARCH_VECTOR)
+        cursor.execute(CREATE_SEARCH_INDEX)
+        cursor.execute(DROP_FULL_TEXT_INDEX)
+    connection.commit()
+    print("tweets.search_vector and its GIN index are ready")
+
+
+if __name__ == "__main__":
+    connection = connect()
+    try:
+        migrate(connection)
+    finally:
+        connection.close()
@@ -0,0 +1,30 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from database import connect
+
+'''
+This migration adds the (created_at, id) index that /home/ and /tweets_by_date/ page through. With it, each page is read by starting right after the
+cursor in the index and stopping after limit rows, instead of skipping over every earlier row like offset(skip) did. CONCURRENTLY builds the index without
+blocking inserts, which is why the connection runs in autocommit mode.
+
+Run it from the data folder with: python migrations/keyset_index.py
+'''
+
+CREATE_KEYSET_INDEX = "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_tweets_created_at_id ON tweets (created_at, id)"
+
+
+def migrate(connection):
+    connection.autocommit = True
+    with connection.cursor() as cursor:
+        cursor.execute(CREATE_KEYSET_INDEX)
+    print("ix_tweets_created_at_id is ready")
+
+
+if __name__ == "__main__":
+    connection = connect()
+    try:
+        migrate(connection)
+    finally:
+        connection.close()
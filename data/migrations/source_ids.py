@@ -0,0 +1,50 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from database import connect
+
+'''
+This migration adds the source_id and content_hash columns that the incremental mode of preprocessing.py (--incremental id or --incremental hash) uses to
+skip tweets that are already in the database, along with an index on each of them so that a chunk of tweets can be looked up at once.
+
+content_hash is filled in for the rows that are already loaded, with the same SHA-256 hash of full_text that loader.content_hash computes. source_id cannot
+be filled in, since the tweet ids were not kept before this column existed, so a database loaded before this migration should use --incremental hash (or
+be loaded again from the beginning with --restart).
+
+Run it from the data folder with: python migrations/source_ids.py
+'''
+
+ADD_COLUMNS = """
+ALTER TABLE tweets ADD COLUMN IF NOT EXISTS source_id TEXT;
+ALTER TABLE tweets ADD COLUMN IF NOT EXISTS content_hash TEXT
+"""
+
+BACKFILL_CONTENT_HASH = "UPDATE tweets SET content_hash = encode(sha256(convert_to(full_text, 'UTF8')), 'hex') WHERE content_hash IS NULL"
+
+CREATE_INDEXES = [
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_tweets_source_id ON tweets (source_id)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_tweets_content_hash ON tweets (content_hash)",
+]
+
+
+def migrate(connection):
+    with connection.cursor() as cursor:
+        cursor.execute(ADD_COLUMNS)
+        cursor.execute(BACKFILL_CONTENT_HASH)
+        print(f"Hashed the full text of {cursor.rowcount} tweets")
+    connection.commit()
+    # CONCURRENTLY cannot run inside a transaction, so the indexes are built in autocommit mode without blocking inserts
+    connection.autocommit = True
+    with connection.cursor() as cursor:
+        for statement in CREATE_INDEXES:
+            cursor.execute(statement)
+    print("tweets.source_id, tweets.content_hash and their indexes are ready")
+
+
+if __name__ == "__main__":
+    connection = connect()
+    try:
+        migrate(connection)
+    finally:
+        connection.close()
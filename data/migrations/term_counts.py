@@ -0,0 +1,41 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from database import connect
+sys.path.append(os.path.join(os.path.dirname(__file__), '../preprocessing'))
+from loader import CREATE_TERM_COUNTS_TABLE
+
+'''
+This migration creates the term_counts table used by /most_frequent/ and fills it from the tweets that are already in the database. preprocessing.py keeps
+the table up to date for every tweet it loads afterwards, so this only has to be run once on a database that was loaded before term_counts existed. Running
+it again rebuilds the counts from scratch.
+
+Run it from the data folder with: python migrations/term_counts.py
+'''
+
+# Splits the cleaned text on whitespace, the same way str.split() does in preprocessing.py, and counts every word per day
+REBUILD_TERM_COUNTS = r"""
+INSERT INTO term_counts (day, term, count)
+SELECT tweets.created_at::date, word, count(*)
+FROM tweets, regexp_split_to_table(tweets.text, '\s+') AS word
+WHERE word <> ''
+GROUP BY tweets.created_at::date, word
+"""
+
+
+def migrate(connection):
+    with connection.cursor() as cursor:
+        cursor.execute(CREATE_TERM_COUNTS_TABLE)
+        cursor.execute("TRUNCATE TABLE term_counts")
+        cursor.execute(REBUILD_TERM_COUNTS)
+        print(f"Saved {cursor.rowcount} (day, term) counts")
+    connection.commit()
+
+
+if __name__ == "__main__":
+    connection = connect()
+    try:
+        migrate(connection)
+    finally:
+        connection.close()
@@ -0,0 +1,136 @@
+import itertools
+from collections import deque
+import spacy
+
+'''
+This file holds the batched text cleaning used by preprocessing.py. Instead of calling nlp(text) once per tweet, the tweets are streamed through nlp.pipe,
+which groups them into batches and can spread the batches across several worker processes. The output is exactly the same as running the full pipeline on
+each tweet: the lemmas of every token that is not a stop word and only contains alphabetic characters, joined with a space. verify_cleaning checks this.
+
+When a TextCache is given (see text_cache.py), the tweets are looked up in it first and only the ones that have not been cleaned before are sent through
+nlp.pipe. Every miss goes through the same long-running nlp.pipe call, so its worker processes are started once per run, and the cleaned texts are put back
+in order with the ones read from the cache.
+'''
+
+# The cleaning filter only reads token.lemma_, token.is_stop and token.is_alpha. is_stop and is_alpha are lexical attributes, and the rule based lemmatizer
+# only needs the part of speech tags from the tagger and attribute_ruler, so the parser and the named entity recognizer can be turned off
+UNUSED_COMPONENTS = ["parser", "ner"]
+
+# Default number of tweets that are sent through the pipeline at once
+BATCH_SIZE = 256
+
+# Number of tweets looked up in the cache with one query, and number of newly cleaned texts written to it at once
+CACHE_CHUNK_SIZE = 4096
+
+# Largest number of tweets held while the oldest one waits for nlp.pipe. nlp.pipe reads a whole batch of texts before it returns the first one, so when
+# the rest of the input is mostly cached, it is given empty texts past this point instead of reading further
+MAX_HELD = 4 * CACHE_CHUNK_SIZE
+
+# Part of the cache namespace. It has to be raised whenever filter_tokens or UNUSED_COMPONENTS change, so that the old cleaned texts are not used
+CLEANING_VERSION = 1
+
+
+# Loads the SpaCy model with only the components that the cleaning filter needs
+def load_cleaner(model_name = 'en_core_web_sm'):
+    return spacy.load(model_name, disable = UNUSED_COMPONENTS)
+
+
+# Keeps the lemmas of the tokens that are not stop words and only contain alphabetic characters, for a document that has already been processed by SpaCy
+def filter_tokens(doc):
+    cleaned_tokens = [token.lemma_ for token in doc if not token.is_stop and token.is_alpha]
+    return ' '.join(cleaned_tokens)
+
+
+# Names the cache entries made by this model, its version and the cleaning filter
+def cleaning_namespace(nlp):
+    return f"clean:{nlp.meta['lang']}_{nlp.meta['name']}-{nlp.meta['version']}:{CLEANING_VERSION}"
+
+
+# Streams (text, context) tuples through nlp.pipe and yields (cleaned_text, context) tuples in the same order. The context is passed through untouched so that
+# the rest of each tweet can travel alongside its text
+def clean_stream(nlp, items, batch_size = BATCH_SIZE, n_process = 1, cache = None):
+    if cache is None:
+        for doc, context in nlp.pipe(items, as_tuples = True, batch_size = batch_size, n_process = n_process):
+            yield filter_tokens(doc), context
+        return
+    yield from _clean_with_cache(nlp, items, batch_size, n_process, cache)
+
+
+# Marks a tweet whose text is still being cleaned
+_PENDING = object()
+
+
+# The cached version of clean_stream. The tweets are read in chunks of CACHE_CHUNK_SIZE and looked up in the cache, and each one is kept as a
+# [cleaned_text, context] entry in the order it was read. The texts that were not found are fed to a single nlp.pipe call, which only pulls them (and so
+# only reads further chunks) when the oldest entry is still waiting for its cleaned text. A run of cached tweets is passed on without touching SpaCy, and
+# no more than about MAX_HELD entries are held at once
+def _clean_with_cache(nlp, items, batch_size, n_process, cache):
+    namespace = cleaning_namespace(nlp)
+    items = iter(items)
+    # Entries in the order the tweets were read, the texts waiting for nlp.pipe, the entries waiting for each text that is being cleaned (each distinct
+    # text is only cleaned once) and the cleaned texts that have not been written to the cache yet
+    entries = deque()
+    to_clean = deque()
+    waiting = {}
+    cleaned = {}
+
+    # Reads and looks up the next chunk of tweets. Returns False once the input has run out
+    def read_chunk():
+        chunk = list(itertools.islice(items, CACHE_CHUNK_SIZE))
+        if not chunk:
+            return False
+        found = cache.get_texts(namespace, [text for text, context in chunk if text not in cleaned and text not in waiting])
+        found.update((text, cleaned[text]) for text, context in chunk if text in cleaned)
+        for text, context in chunk:
+            entry = [found.get(text, _PENDING), context]
+            entries.append(entry)
+            if entry[0] is not _PENDING:
+                continue
+            if text not in waiting:
+                waiting[text] = []
+                to_clean.append(text)
+            waiting[text].append(entry)
+        return True
+
+    # The input of nlp.pipe. The text is passed as the context, so every document comes back with the text it was made from. The empty texts that fill
+    # up a batch once MAX_HELD tweets are held have no context
+    def missing_texts():
+        while True:
+            if to_clean:
+                text = to_clean.popleft()
+                yield text, text
+            elif len(entries) >= MAX_HELD:
+                yield "", None
+            elif not read_chunk():
+                return
+
+    docs = nlp.pipe(missing_texts(), as_tuples = True, batch_size = batch_size, n_process = n_process)
+    while entries or read_chunk():
+        if entries[0][0] is _PENDING:
+            # The oldest tweet is still waiting, so the next cleaned text is taken from nlp.pipe. It always belongs to a waiting text, since the texts go
+            # through nlp.pipe in the order they were read
+            doc, text = next(docs)
+            if text is None:
+                continue
+            cleaned[text] = filter_tokens(doc)
+            for entry in waiting.pop(text):
+                entry[0] = cleaned[text]
+            if len(cleaned) >= CACHE_CHUNK_SIZE:
+                cache.put_texts(namespace, cleaned)
+                cleaned = {}
+            continue
+        yield tuple(entries.popleft())
+    cache.put_texts(namespace, cleaned)
+
+
+# Cleans a list of texts and returns the cleaned texts in the same order
+def clean_texts(nlp, texts, batch_size = BATCH_SIZE, n_process = 1):
+    return [filter_tokens(doc) for doc in nlp.pipe(texts, batch_size = batch_size, n_process = n_process)]
+
+
+# Compares the batched cleaner against the full pipeline, run on one tweet at a time, and returns the texts that do not match
+def verify_cleaning(texts, model_name = 'en_core_web_sm', batch_size = BATCH_SIZE, n_process = 1):
+    full_nlp = spacy.load(model_name)
+    expected = [filter_tokens(full_nlp(text)) for text in texts]
+    actual = clean_texts(load_cleaner(model_name), texts, batch_size = batch_size, n_process = n_process)
+    return [(text, want, got) for text, want, got in zip(texts, expected, actual) if want != got]
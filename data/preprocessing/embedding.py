@@ -0,0 +1,89 @@
+import numpy as np
+import torch
+from transformers import BertModel, BertTokenizer
+
+'''
+This file makes the BERT embeddings for preprocessing.py. Running a full BERT forward pass on a [1, seq_len] tensor for every tweet leaves most of the
+CPU's matrix throughput unused. EmbeddingEngine instead groups the texts by token length, pads each group into a [batch_size, seq_len] tensor and passes an
+attention mask, so that the padding is ignored by BERT and left out of the mean pooling. The vectors match the output of one forward pass per tweet within
+floating point tolerance, which verify_embeddings checks.
+
+When a TextCache is given (see text_cache.py), embed only runs BERT on the texts that are not in the cache yet, and each distinct text in a call is only
+embedded once, so retweets and repeated texts cost a single forward pass.
+'''
+
+# Default number of tweets that are sent through BERT at once
+BATCH_SIZE = 32
+
+
+class EmbeddingEngine:
+    def __init__(self, model_name = "bert-base-uncased", batch_size = BATCH_SIZE, num_threads = None, cache = None):
+        # Caps the number of threads torch uses for a single matrix operation, which is useful when other stages are running at the same time
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.batch_size = batch_size
+        self.tokenizer = BertTokenizer.from_pretrained(model_name)
+        self.bert = BertModel.from_pretrained(model_name)
+        # Turns off dropout so that the output is the same as a single forward pass
+        self.bert.eval()
+        self.cache = cache
+        # The cache entries are tied to the model and the revision of its weights, so a different model never reads them
+        self.cache_namespace = f"embed:{model_name}@{getattr(self.bert.config, '_commit_hash', None) or 'unknown'}"
+
+    # Converts a text into token ids (without the [CLS] and [SEP] tokens), the way each tweet has always been embedded
+    def token_ids(self, text):
+        return self.tokenizer.convert_tokens_to_ids(self.tokenizer.tokenize(text))
+
+    # Returns a float32 array of shape [len(texts), hidden_size] with one mean pooled vector per text, in the same order as texts. The texts that are in
+    # the cache are read from it, and the rest are computed and added to it
+    def embed(self, texts):
+        if self.cache is None:
+            return self.compute(texts)
+        vectors = self.cache.get_vectors(self.cache_namespace, texts)
+        missing = [text for text in dict.fromkeys(texts) if text not in vectors]
+        if missing:
+            computed = dict(zip(missing, self.compute(missing)))
+            self.cache.put_vectors(self.cache_namespace, computed)
+            vectors.update(computed)
+        if not texts:
+            return np.zeros((0, self.bert.config.hidden_size), dtype = np.float32)
+        return np.stack([vectors[text] for text in texts])
+
+    # Runs every text through BERT, without the cache
+    def compute(self, texts):
+        ids = [self.token_ids(text) for text in texts]
+        vectors = np.zeros((len(texts), self.bert.config.hidden_size), dtype = np.float32)
+        # Sorting by length keeps texts of a similar length in the same batch, so very little of each batch is padding
+        order = sorted(range(len(ids)), key = lambda i: len(ids[i]))
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            vectors[batch] = self._embed_batch([ids[i] for i in batch])
+        return vectors
+
+    def _embed_batch(self, batch_ids):
+        seq_len = max(1, max(len(ids) for ids in batch_ids))
+        input_ids = torch.full((len(batch_ids), seq_len), self.tokenizer.pad_token_id, dtype = torch.long)
+        attention_mask = torch.zeros((len(batch_ids), seq_len), dtype = torch.long)
+        for row, ids in enumerate(batch_ids):
+            input_ids[row, :len(ids)] = torch.tensor(ids, dtype = torch.long)
+            attention_mask[row, :len(ids)] = 1
+        # Prevents tracking gradients, which reduces memory usage and speeds up computations
+        with torch.no_grad():
+            hidden = self.bert(input_ids, attention_mask = attention_mask)[0]
+            # Average the hidden states of the real tokens only, so that the padding does not change the result
+            mask = attention_mask.unsqueeze(-1).to(hidden.dtype)
+            summed = (hidden * mask).sum(dim = 1)
+            counts = mask.sum(dim = 1).clamp(min = 1)
+        return (summed / counts).numpy()
+
+
+# Compares the batched engine against one forward pass per text and returns the largest absolute difference between the vectors
+def verify_embeddings(engine, texts):
+    batched = engine.compute(texts)
+    largest = 0.0
+    for text, vector in zip(texts, batched):
+        tokens_tensor = torch.tensor([engine.token_ids(text)])
+        with torch.no_grad():
+            expected = engine.bert(tokens_tensor)[0].mean(dim = 1).numpy().flatten()
+        largest = max(largest, float(np.abs(expected - vector).max()))
+    return largest
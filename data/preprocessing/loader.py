@@ -0,0 +1,194 @@
+import hashlib
+import time
+from collections import Counter
+from psycopg2.extras import execute_values
+
+'''
+BulkLoader replaces the per-row INSERT and commit in preprocessing.py. Rows are collected into chunks and each chunk is written with a single parameterized
+execute_values call inside one transaction, so a chunk costs one round trip and one commit instead of one per tweet. The values are passed as parameters,
+which means quotes in the tweets no longer need to be escaped by hand.
+
+Every chunk also updates the ingest_checkpoint table in the same transaction with the byte offset in tweets.jl that the chunk ends at and the number of rows
+loaded so far. If a run crashes, the next run reads the checkpoint and continues from that offset instead of starting over, and because the checkpoint is
+committed together with the rows, a chunk can never be loaded twice.
+
+The same transaction also adds the words in each row's cleaned text to the term_counts table, which keeps one count per (day, term). /most_frequent/ reads
+its results from that table instead of splitting every tweet on each request.
+
+Each chunk also adds one to the version in the dataset_version table. The API includes that version in the keys of its query cache, so cached results
+are not served once new tweets have been loaded.
+
+Every row keeps the tweet's id from the source (source_id) and a hash of its full text (content_hash). find_existing looks them up so that the incremental
+mode of preprocessing.py can skip the tweets that are already in the database before any work is spent on them.
+
+Once app/api/clusters.py has trained the topic clusters, every row is also given the cluster of its closest centroid (cluster_id), and each chunk adds its
+rows to the size of their clusters in the same transaction, so /clusters/ stays up to date without running k-means again. The clusters are assigned at the
+start of that transaction rather than when the rows are built, so that they always come from the centroids that are saved when the chunk commits, even if
+clusters.py is run again in the middle of a load (see ClusterAssigner in app/api/clusters.py).
+'''
+
+# Default number of rows written in one transaction
+CHUNK_SIZE = 1000
+
+TWEET_COLUMNS = ("created_at", "lang", "text", "full_text", "sentiment", "sentiment_val", "embedding_vector", "source_id", "content_hash",
+                 "cluster_id")
+
+# The columns the incremental mode can use to recognize a tweet that was already loaded
+DEDUPE_COLUMNS = {"id": "source_id", "hash": "content_hash"}
+
+CREATE_CHECKPOINT_TABLE = """
+CREATE TABLE IF NOT EXISTS ingest_checkpoint (
+    source TEXT PRIMARY KEY,
+    file_offset BIGINT NOT NULL,
+    row_count BIGINT NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT now()
+)
+"""
+
+CREATE_TERM_COUNTS_TABLE = """
+CREATE TABLE IF NOT EXISTS term_counts (
+    day DATE NOT NULL,
+    term TEXT NOT NULL,
+    count BIGINT NOT NULL,
+    PRIMARY KEY (day, term)
+)
+"""
+
+SAVE_TERM_COUNTS = """
+INSERT INTO term_counts (day, term, count) VALUES %s
+ON CONFLICT (day, term) DO UPDATE SET count = term_counts.count + EXCLUDED.count
+"""
+
+CREATE_DATASET_VERSION_TABLE = """
+CREATE TABLE IF NOT EXISTS dataset_version (
+    id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT now()
+);
+INSERT INTO dataset_version (id) VALUES (1) ON CONFLICT (id) DO NOTHING
+"""
+
+BUMP_DATASET_VERSION = "UPDATE dataset_version SET version = version + 1, updated_at = now()"
+
+SAVE_CLUSTER_SIZES = """
+UPDATE clusters SET size = clusters.size + added.count FROM (VALUES %s) AS added (id, count) WHERE clusters.id = added.id
+"""
+
+SAVE_CHECKPOINT = """
+INSERT INTO ingest_checkpoint (source, file_offset, row_count, updated_at) VALUES (%s, %s, %s, now())
+ON CONFLICT (source) DO UPDATE SET file_offset = EXCLUDED.file_offset, row_count = EXCLUDED.row_count, updated_at = now()
+"""
+
+
+# Returns a hash of the tweet's full text, which identifies tweets (and retweets) with the same text even when they have different ids
+def content_hash(full_text):
+    return hashlib.sha256(full_text.encode("utf-8")).hexdigest()
+
+
+# Returns the values (source ids or content hashes, see DEDUPE_COLUMNS) that are already in the tweets table
+def find_existing(connection, column, values):
+    if not values:
+        return set()
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT {column} FROM tweets WHERE {column} = ANY(%s)", (list(values),))
+        found = {record[0] for record in cursor.fetchall()}
+    connection.commit()
+    return found
+
+
+# Counts the words in the cleaned text of each row per day and returns (day, term, count) tuples. The words are split the same way /most_frequent/ always has
+def count_terms(rows):
+    created_at = TWEET_COLUMNS.index("created_at")
+    text = TWEET_COLUMNS.index("text")
+    counts = Counter((row[created_at], word) for row in rows for word in row[text].split())
+    return [(day, term, count) for (day, term), count in counts.items()]
+
+
+# Returns the rows with their cluster_id replaced by the given cluster ids
+def with_cluster_ids(rows, cluster_ids):
+    index = TWEET_COLUMNS.index("cluster_id")
+    return [row[:index] + (cluster_id,) + row[index + 1:] for row, cluster_id in zip(rows, cluster_ids)]
+
+
+# Counts the rows of each cluster and returns (cluster_id, count) tuples. Rows without a cluster (loaded before any clusters were trained) are left out
+def count_clusters(rows):
+    cluster_id = TWEET_COLUMNS.index("cluster_id")
+    counts = Counter(row[cluster_id] for row in rows if row[cluster_id] is not None)
+    return list(counts.items())
+
+
+class BulkLoader:
+    def __init__(self, connection, source, chunk_size = CHUNK_SIZE, clusters = None):
+        self.connection = connection
+        # The name the checkpoint is saved under, normally the name of the file being loaded
+        self.source = source
+        self.chunk_size = chunk_size
+        # A ClusterAssigner that gives every row its cluster_id when its chunk is written. Without one, the rows keep the cluster_id they were added with
+        self.clusters = clusters
+        self.rows = []
+        self.offset = 0
+        self.row_count = 0
+        self.started = time.perf_counter()
+        self.loaded_this_run = 0
+        with self.connection.cursor() as cursor:
+            cursor.execute(CREATE_CHECKPOINT_TABLE)
+            cursor.execute(CREATE_TERM_COUNTS_TABLE)
+            cursor.execute(CREATE_DATASET_VERSION_TABLE)
+        self.connection.commit()
+
+    # Returns the (file_offset, row_count) saved by the last run, or (0, 0) if the source has not been loaded before
+    def checkpoint(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute("SELECT file_offset, row_count FROM ingest_checkpoint WHERE source = %s", (self.source,))
+            record = cursor.fetchone()
+        self.offset, self.row_count = record if record else (0, 0)
+        return self.offset, self.row_count
+
+    # Removes the saved checkpoint so that the next run starts from the beginning of the file
+    def reset(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute("DELETE FROM ingest_checkpoint WHERE source = %s", (self.source,))
+        self.connection.commit()
+        self.offset, self.row_count = 0, 0
+
+    # Adds a row (in the order of TWEET_COLUMNS) that ends at the given byte offset. The chunk is written once it is full
+    def add(self, row, offset):
+        self.rows.append(row)
+        self.offset = offset
+        if len(self.rows) >= self.chunk_size:
+            return self.flush()
+        return 0
+
+    # Writes the collected rows and the new checkpoint in one transaction and returns the number of rows written
+    def flush(self):
+        if not self.rows:
+            return 0
+        rows = self.rows
+        written = len(rows)
+        try:
+            with self.connection.cursor() as cursor:
+                if self.clusters is not None:
+                    # This comes first, since it locks the clusters table until the commit and reloads the centroids if they were retrained
+                    embedding_vector = TWEET_COLUMNS.index("embedding_vector")
+                    rows = with_cluster_ids(rows, self.clusters.assign(cursor, [row[embedding_vector] for row in rows]))
+                execute_values(cursor, f"INSERT INTO tweets ({', '.join(TWEET_COLUMNS)}) VALUES %s", rows, page_size = self.chunk_size)
+                execute_values(cursor, SAVE_TERM_COUNTS, count_terms(rows), page_size = self.chunk_size)
+                cluster_counts = count_clusters(rows)
+                if cluster_counts:
+                    execute_values(cursor, SAVE_CLUSTER_SIZES, cluster_counts)
+                cursor.execute(SAVE_CHECKPOINT, (self.source, self.offset, self.row_count + written))
+                cursor.execute(BUMP_DATASET_VERSION)
+            self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            raise
+        self.rows = []
+        self.row_count += written
+        self.loaded_this_run += written
+        print(f"Loaded {self.row_count} rows ({self.rate():.1f} rows/sec)")
+        return written
+
+    # Returns the number of rows loaded per second during this run
+    def rate(self):
+        seconds = time.perf_counter() - self.started
+        return self.loaded_this_run / seconds if seconds > 0 else 0.0
@@ -0,0 +1,105 @@
+import queue
+import threading
+
+'''
+Pipeline runs the stages of preprocessing.py at the same time instead of one after the other. Every stage runs in its own thread and hands its output to
+the next stage through a bounded queue, so while BERT embeds one chunk of tweets, SpaCy is already cleaning the next one and the loader is writing the one
+before. torch, SpaCy and psycopg2 release the GIL during their heavy work, which is what lets the threads overlap. A bounded queue blocks a stage that gets
+too far ahead of the next one, so the memory used stays the same no matter how large the input is.
+
+Each stage is a function that takes an iterator over the previous stage's output and yields its own output, and the last stage's output is read by the
+caller. Every stage keeps the order of its input, so the rows still reach the loader in file order and the checkpoint offsets stay correct. If a stage
+raises an error, every other stage stops and the error is raised again in the caller.
+
+When a StageTimer is given, the time each stage spends waiting for its input is recorded as "<stage> wait", which shows which stages are starved and which
+one is the bottleneck.
+'''
+
+# Put on a queue after the last item of a stage
+_END = object()
+
+# How often (in seconds) a blocked stage checks whether the pipeline has been stopped
+_POLL_INTERVAL = 0.1
+
+
+class Pipeline:
+    def __init__(self, name, source, queue_size, timer = None):
+        # (name, function, queue_size) for every stage. The source is read in the first stage's thread
+        self.stages = [(name, lambda items: source, queue_size)]
+        self.timer = timer
+        self.error = None
+        self._stopped = threading.Event()
+        self._threads = []
+
+    # Adds a stage that reads the output of the previous stage. queue_size is the number of its items that can wait for the next stage
+    def add_stage(self, name, function, queue_size):
+        self.stages.append((name, function, queue_size))
+        return self
+
+    # Starts every stage and yields the output of the last one. name is used to time the caller's own waits
+    def run(self, name):
+        input_queue = None
+        for stage_name, function, queue_size in self.stages:
+            output_queue = queue.Queue(queue_size)
+            thread = threading.Thread(target = self._run_stage, args = (stage_name, function, input_queue, output_queue), name = stage_name, daemon = True)
+            thread.start()
+            self._threads.append(thread)
+            input_queue = output_queue
+        try:
+            yield from self._read(input_queue, name)
+        finally:
+            # Stops the stages if the caller stopped reading early or failed
+            self.stop()
+        if self.error is not None:
+            raise self.error
+
+    def stop(self):
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join()
+
+    def _run_stage(self, name, function, input_queue, output_queue):
+        try:
+            items = self._read(input_queue, name) if input_queue is not None else iter(())
+            for item in function(items):
+                if not self._put(output_queue, item):
+                    return
+        except BaseException as error:
+            # Only the first error is kept, since the others are usually caused by it
+            if self.error is None:
+                self.error = error
+            self._stopped.set()
+        finally:
+            self._put(output_queue, _END)
+
+    # Yields the items on the queue until the previous stage has finished or the pipeline has been stopped
+    def _read(self, input_queue, name):
+        while True:
+            item = self._get(input_queue, name)
+            if item is _END:
+                return
+            yield item
+
+    def _get(self, input_queue, name):
+        if self.timer is None:
+            return self._wait_for_item(input_queue)
+        with self.timer.time(f"{name} wait", 0):
+            return self._wait_for_item(input_queue)
+
+    def _wait_for_item(self, input_queue):
+        while not self._stopped.is_set():
+            try:
+                return input_queue.get(timeout = _POLL_INTERVAL)
+            except queue.Empty:
+                continue
+        return _END
+
+    # Returns False if the pipeline was stopped before the item could be put on the queue
+    def _put(self, output_queue, item):
+        while not self._stopped.is_set():
+            try:
+                output_queue.put(item, timeout = _POLL_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+        return False
@@ -1,11 +1,30 @@
+import argparse
+import hashlib
+import itertools
 import json
 import os
+import sys
+import zipfile
+from collections import Counter
+from contextlib import contextmanager
 from datetime import datetime
 import psycopg2
-import spacy
-import torch
 from textblob import TextBlob
-from transformers import BertModel, BertTokenizer
+from cleaning import BATCH_SIZE, clean_stream, load_cleaner, verify_cleaning
+from embedding import EmbeddingEngine, verify_embeddings
+from loader import CHUNK_SIZE as LOAD_CHUNK_SIZE, DEDUPE_COLUMNS, BulkLoader, content_hash, find_existing
+from pipeline import Pipeline
+
+# data/database.py is imported before app/api is added to the path, since app/api has a database.py of its own
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from database import connect
+# The helpers that read and write the embedding_vector column are shared with the API, so that both sides agree on the format
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../app/api'))
+from embedding_codec import encode_embedding
+# New tweets are given the topic cluster of their closest centroid, using the centroids app/api/clusters.py saved
+from clusters import ClusterAssigner
+from text_cache import MAX_BYTES as TEXT_CACHE_BYTES, TextCache
+from timing import StageTimer
 
 '''
 The following code is used to observe the first line of the data in order to figure out which values are relevant to the project
@@ -13,17 +32,69 @@ The following code is used to observe the first line of the data in order to fig
 # Get the current directory of preprocessing.py
 current_dir = os.path.dirname(__file__)
 
-# Specify the path in a way that is reproducable
-file_path = os.path.join(current_dir, '../tweets.jl')
+# Specify the path in a way that is reproducable. The tweets are read straight out of the zip archive in the root of the project, so it does not have to
+# be extracted first. --source can point at an extracted tweets.jl (or another archive) instead
+file_path = os.path.join(current_dir, '../../17616581.tweets.zip')
+
+# Largest number of bytes of the first line of the tweets that are hashed to tell one input file from another
+IDENTITY_BLOCK_SIZE = 64 * 1024
+
+# Largest number of bytes read back from a checkpoint's offset to find the line that ends there
+CHECK_BLOCK_SIZE = 1024 * 1024
+
+
+# Returns the ZipInfo of the one .jl file in an archive
+def jl_entry(archive, path):
+    entries = [info for info in archive.infolist() if info.filename.endswith('.jl')]
+    if len(entries) != 1:
+        raise ValueError(f"Expected one .jl file in {path}, found {len(entries)}")
+    return entries[0]
+
+
+# Opens the tweets for reading in binary mode. For a .zip archive, the .jl file inside it is decompressed as it is read instead of being extracted to disk
+@contextmanager
+def open_source(path):
+    if not path.endswith('.zip'):
+        with open(path, 'rb') as file:
+            yield file
+        return
+    with zipfile.ZipFile(path) as archive:
+        with archive.open(jl_entry(archive, path)) as file:
+            yield file
+
+
+# Returns the name the checkpoint of a source is saved under: the file name and a hash of its first line (at most IDENTITY_BLOCK_SIZE bytes of it). A daily
+# feed that reuses a file name starts with a different tweet, so it gets its own checkpoint and is read from the beginning instead of from the previous
+# file's byte offset. Tweets appended to a file do not change its first line, so the file keeps its checkpoint and only the new tweets are read
+def source_identity(path):
+    with open_source(path) as file:
+        head = file.readline(IDENTITY_BLOCK_SIZE)
+    return f"{os.path.basename(path)}:{hashlib.sha256(head).hexdigest()[:16]}"
+
+
+# Checks that a saved checkpoint still fits the file before the run seeks to it: the offset has to be inside the file and at the end of a line, and that line
+# has to be a tweet that is already in the database (a chunk's checkpoint always ends with the last row the chunk wrote). A file that was rewritten rather
+# than appended to fails the check
+def checkpoint_matches(path, offset, connection):
+    start = max(0, offset - CHECK_BLOCK_SIZE)
+    with open_source(path) as file:
+        file.seek(start)
+        block = file.read(offset - start)
+    if len(block) != offset - start or not block.endswith(b"\n"):
+        return False
+    try:
+        data = json.loads(block[:-1].rsplit(b"\n", 1)[-1])['document']
+        full_text = data['full_text'] if 'full_text' in data else data['text']
+    except (ValueError, KeyError):
+        return False
+    return bool(find_existing(connection, DEDUPE_COLUMNS['hash'], {content_hash(full_text)}))
 
-# Print the file path for debugging
-print(f"File path: {file_path}")
 
 # Function to read and print the first line from a JSON Lines file
 def view_first_line(file_path):
     try:
         # Open the tweets.jl file
-        with open(file_path, 'r') as file:
+        with open_source(file_path) as file:
             # Read the first line
             first_line = file.readline().strip()
             # Parse the first line
@@ -34,148 +105,259 @@ def view_first_line(file_path):
     except FileNotFoundError:
         print(f"File not found: {file_path}")
     
-# Call the function to view the first line
-view_first_line(file_path)
-
 '''
 Data relevant to this project, and therefore should be kept, are date tweeted (created_at), text, full_text, and language the tweet was written in (lang),
 which are all in the document section of the file. The text data will be cleaned using SpaCy by lemmatization, which will reduce the words to their base form, 
-removing stop words, which do not significantly impact the meaning of the text, and removing values that do not consist of alphabetic characters. 
+removing stop words, which do not significantly impact the meaning of the text, and removing values that do not consist of alphabetic characters. The
+cleaning itself is done in batches by cleaning.py, and verify_cleaning there compares it with running the full SpaCy pipeline on one tweet at a time.
 '''
 
-# Load in SpaCy for data cleaning
-nlp = spacy.load('en_core_web_sm')
-# Load in bert for embedding
-nlp2 = spacy.load('en_core_web_trf')
-
-# Function to clean text using SpaCy
-def clean_text(text):
-    doc = nlp(text)
-    # Iterate over the tokens in the text and lemmatize and save the tokens that are not stop words and contain only alphabetic characters
-    cleaned_tokens = [token.lemma_ for token in doc if not token.is_stop and token.is_alpha]
-    # Join the cleaned tokens with a space
-    cleaned_text = ' '.join(cleaned_tokens)
-    return cleaned_text
-
 '''
 The BERT model will be used to create the embeddings, which can be used for the similarity search later on in the project. The code and explanations for the 
 BERT model is largely influenced by a blog called "How to use BERT Sentence Embedding for Clustering text" by Nikita Sharma, found at:
-https://techblog.assignar.com/how-to-use-bert-sentence-embedding-for-clustering-text/. 
+https://techblog.assignar.com/how-to-use-bert-sentence-embedding-for-clustering-text/. The embeddings are made in padded batches by embedding.py, and
+verify_embeddings there compares them with one BERT forward pass per tweet.
 '''
 
-# Load BERT model and tokenizer
-bert = BertModel.from_pretrained("bert-base-uncased")
-tokenizer = BertTokenizer.from_pretrained("bert-base-uncased")
-
-# Function to get embedding values from the text
-def get_embeddings(text):
-    # Split the text into single word tokens
-    tokens = tokenizer.tokenize(text)
-    # Convert the tokens into id counterparts
-    indexed_tokens = tokenizer.convert_tokens_to_ids(tokens)
-    # Add a batch dimension so that the tokens can be fed through the bert model
-    tokens_tensor = torch.tensor([indexed_tokens])
-    # Prevents tracking gradients, which reduces memory usage and speeds up computations
-    with torch.no_grad():
-        # Create a variable that contains all of the elements produced by the bert model
-        outputs = bert(tokens_tensor)
-        # Creat a variable of the averages among the hidden states across all tokens
-        embeddings = outputs[0].mean(dim=1) 
-    # Return a NumPy array if the embedding values
-    return embeddings.numpy()
-
-# flattens the array
-def flatten_array(array):
-    return array.flatten()
+
+# Groups an iterator into lists of up to size items so that the embedding stage can work on several tweets at once
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+# Reads the tweets.jl file (opened in binary mode) line by line, starting at the given byte offset, and yields (text, (offset, data)) tuples that are ready to
+# be sent through the cleaning stage. offset is the position right after the line, which is where a resumed run would start
+def parse_tweets(file, offset = 0):
+    file.seek(offset)
+    for line in file:
+        offset += len(line)
+        try:
+            # The results variable is assigned the parsed json text
+            results = json.loads(line)
+        # If there is an error, print out the error message
+        except json.JSONDecodeError as e:
+            print(f"Error decoding JSON: {e}")
+            continue
+        data = results['document']
+        # If full_text is not in the data, preserve the text from the 'text' value before 'text' gets cleaned. The values are passed to the database as
+        # parameters, so the quotes no longer need to be escaped
+        if 'full_text' not in data:
+            data['full_text']= data['text']
+        # Keep what identifies the tweet, so that the incremental mode can recognize it on a later run
+        data['source_id'] = data.get('id_str') or (str(data['id']) if 'id' in data else None)
+        data['content_hash'] = content_hash(data['full_text'])
+        yield data.get('text', ''), (offset, data)
+
+# Drops the tweets that are already in the database, or that already appeared in this run, before any work is spent on them. column is source_id or
+# content_hash (see DEDUPE_COLUMNS in loader.py), and every chunk of tweets is looked up with one query
+def skip_existing(items, connection, column, chunk_size, stats):
+    seen = set()
+    for chunk in chunked(items, chunk_size):
+        keys = {data[column] for text, (offset, data) in chunk if data[column] is not None}
+        seen |= find_existing(connection, column, keys - seen)
+        for text, (offset, data) in chunk:
+            key = data[column]
+            if key is not None and key in seen:
+                stats['skipped'] += 1
+                continue
+            if key is not None:
+                seen.add(key)
+            yield text, (offset, data)
+
+# Collects the cleaned tweets into chunks of chunk_size and embeds each chunk with one call to the engine, which sorts it by length and runs it through BERT
+# in padded batches. Yields (chunk, vectors) pairs
+def embed_chunks(items, engine, chunk_size, timer):
+    for chunk in chunked(items, chunk_size):
+        # Replace the text data in data['document'] with the cleaned text
+        for cleaned_text, (offset, data) in chunk:
+            if 'text' in data:
+                data['text']= cleaned_text
+        # If the cleaning removes all words from 'text', the array will end up being empty, which causes a diminsionality error.
+        # These next lines of code prevent the error at the cost of using the full, unedited text, which may slightly change the vector values, but 
+        # keeps the diminsionality greater than 0
+        texts = [data['text'] if len(data['text']) != 0 else data['full_text'] for cleaned_text, (offset, data) in chunk]
+        with timer.time('embed', len(chunk)):
+            vectors = engine.embed(texts)
+        yield chunk, vectors
+
+# Scores the sentiment of every tweet in each chunk and yields the chunk's finished rows, as (row, offset) pairs in the order of TWEET_COLUMNS in loader.py.
+# The cluster_id is left empty here, the loader fills it in when it writes the chunk
+def build_rows(chunks, timer):
+    for chunk, vectors in chunks:
+        rows = []
+        for (cleaned_text, (offset, data)), embedding_vector in zip(chunk, vectors):
+            # The vector is stored as raw float32 bytes (see embedding_codec.py)
+            embedding_vector = encode_embedding(embedding_vector)
+
+            # Edit the created_at value into a more readable format
+            date = datetime.strptime(data['created_at'], "%a %b %d %H:%M:%S %z %Y").strftime("%Y-%m-%d")
+
+            with timer.time('sentiment'):
+                # Perform sentiment analysis using TextBlob
+                blob = TextBlob(data['text'])
+                sentiment_val = blob.sentiment.polarity
+
+            # Determine sentiment category
+            if sentiment_val > 0:
+                sentiment_category = 'Positive'
+            elif sentiment_val < 0:
+                sentiment_category = 'Negative'
+            else:
+                sentiment_category = 'Neutral'
+
+            row = (date, data['lang'], data['text'], data['full_text'], sentiment_category, sentiment_val, embedding_vector,
+                   data['source_id'], data['content_hash'], None)
+            rows.append((row, offset))
+        yield rows
+
+# Reads the options that control how the cleaning stage is spread out
+def parse_args():
+    parser = argparse.ArgumentParser(description = "Clean, embed and load tweets.jl into the tweets database")
+    parser.add_argument("--source", default = file_path, help = "The .zip archive or the extracted .jl file to read the tweets from")
+    parser.add_argument("--batch-size", type = int, default = BATCH_SIZE, help = "Number of tweets sent through SpaCy at once")
+    parser.add_argument("--n-process", type = int, default = 1, help = "Number of worker processes used to clean the tweets")
+    parser.add_argument("--verify-cleaning", type = int, default = 0, metavar = "N",
+                        help = "Compare the batched cleaner with the full SpaCy pipeline on the first N tweets, then exit")
+    parser.add_argument("--embed-batch-size", type = int, default = 32, help = "Number of tweets sent through BERT at once")
+    parser.add_argument("--embed-chunk", type = int, default = 512,
+                        help = "Number of cleaned tweets collected before they are sorted by length and embedded")
+    parser.add_argument("--torch-threads", type = int, default = None, help = "Maximum number of threads torch uses for each operation")
+    parser.add_argument("--verify-embeddings", type = int, default = 0, metavar = "N",
+                        help = "Compare the batched embeddings with one BERT pass per tweet on the first N tweets, then exit")
+    parser.add_argument("--load-chunk", type = int, default = LOAD_CHUNK_SIZE, help = "Number of rows written to the database in one transaction")
+    parser.add_argument("--restart", action = "store_true",
+                        help = "Ignore the saved checkpoint and read tweets.jl from the beginning (rows that were already loaded are not removed)")
+    parser.add_argument("--incremental", nargs = "?", const = "id", choices = sorted(DEDUPE_COLUMNS), default = None,
+                        help = "Skip tweets that are already in the database, recognized by their tweet id (the default) or by a hash of their text")
+    parser.add_argument("--queue-size", type = int, default = 4,
+                        help = "Number of chunks of --embed-chunk tweets that can wait between two stages")
+    parser.add_argument("--text-cache", default = os.path.join(current_dir, 'text_cache.sqlite3'),
+                        help = "SQLite file that keeps the cleaned text and embedding of every text already processed. An empty value turns the cache off")
+    parser.add_argument("--text-cache-mb", type = int, default = TEXT_CACHE_BYTES // 1024 ** 2, help = "Size limit of the text cache in MB")
+    parser.add_argument("--metrics-file", default = None,
+                        help = "Also write the stage timings to this file in the Prometheus text format, for example for a node_exporter textfile collector")
+    return parser.parse_args()
 
 '''
-This next section begins by connecting to the tweets_db PostgreSQL database. The database was created in the PostgreSQL_DB file, which is also in the data
-folder. After creating the connection with the database, the following code iterates throught the tweets.jl file line by line, picks the keys that will be kept,
-and cleans the text data using the clean_text function from above. Once the data is clean, it formats the text in the manner that will be accepted by the
-database and can be used during the project, and then uses SQLs INSERT function to add each row to the database.
+This next section begins by connecting to the tweets_db PostgreSQL database (or the one DATABASE_URL points at, see data/database.py). The database was
+created in the PostgreSQL_DB file, which is also in the data folder. After creating the connection with the database, the following code streams the tweets
+out of the zip archive through the parsing stage, picks the keys that will be kept, and cleans the text data in batches using nlp.pipe (see cleaning.py).
+Once the data is clean, it formats the text in the manner that will be accepted by the database and can be used during the project, and then uses SQLs
+INSERT function to add each row to the database. The stages run at the same time in separate threads, so the next tweets are already being cleaned while
+BERT embeds the current ones.
+
+With --incremental, the tweets that are already in the database (by tweet id, or by a hash of their text with --incremental hash) are dropped right after
+parsing, so a daily feed only pays for cleaning, embedding and loading its new tweets.
 
 TextBlob was used for the sentiment analysis. This code came from a project I worked on previously, where I ran a sentiment analysis on tech reviews for 
 different devices. 
+
+Everything below only runs when preprocessing.py is started directly. The cleaning stage can use several worker processes, and on systems that start those
+workers by re-importing this file, the models and the database work must not run again inside every worker.
 '''
-# Create the connection with the database
-try: 
-    connection = psycopg2.connect(
-        user = "aaronrobinson",
-        password = "test",
-        host = "localhost",
-        port = "5432",
-        database = "tweets_db")
-    cursor = connection.cursor()
-    
-    # Open the tweets.jl file and iterate through it line by line
-    with open(file_path, 'r', encoding='utf-8') as file:
-        for line in file:
-            try:
-                # The results variable is assigned the parsed json text
-                results = json.loads(line)
-                data = results['document']
-                # If full_text is not in the data, preserve the text from the 'text' value before 'text' gets cleaned and remove any single "'"
-                if 'full_text' not in data:
-                    data['full_text']= data['text'].replace("'", "''")
-                else:
-                    data['full_text']= data['full_text'].replace("'", "''")
-                # Use the clean_text function found above to clean the text data in data['document']
-                if 'text' in data:
-                    data['text']= clean_text(data['text'])
-                # If the clean_text function removes all words from 'text', the array will end up being empty, which causes a diminsionality error.
-                # These next lines of code prevent the error at the cost of using the full, unedited text, which may slightly change the vector values, but 
-                # keeps the diminsionality greater than 0
-                if len(data['text']) != 0:
-                    embedding_vector = get_embeddings(data['text'])
-                else:
-                    embedding_vector = get_embeddings(data['full_text'])
-                
-                # These next lines were useful for formatting the vector so that it would not cause issues loading into the database
-                embedding_vector = flatten_array(embedding_vector)
-                embedding_vector = str(embedding_vector.tolist())
-                
-                # Edit the created_at value into a more readable format
-                date = datetime.strptime(data['created_at'], "%a %b %d %H:%M:%S %z %Y").strftime("%Y-%m-%d")
-                # Format the data so that they will be accepted into the VALUES section of the query
-                data['created_at'] = f"'{date}'"
-                data['lang'] = f"'{data['lang']}'"
-                data['text'] = f"'{data['text']}'"
-                if 'full_text' in data:
-                    data['full_text'] = f"'{data['full_text']}'"
-                else:
-                    data['full_text'] = data['text']
+if __name__ == "__main__":
+    args = parse_args()
 
-                # Perform sentiment analysis using TextBlob
-                blob = TextBlob(data['text'])
-                sentiment_val = blob.sentiment.polarity
+    # Print the file path for debugging
+    print(f"File path: {args.source}")
+
+    # Call the function to view the first line
+    view_first_line(args.source)
+
+    # Check that the batched cleaner gives the same output as the full pipeline before loading anything
+    if args.verify_cleaning:
+        with open_source(args.source) as file:
+            texts = [text for text, context in itertools.islice(parse_tweets(file), args.verify_cleaning)]
+        mismatches = verify_cleaning(texts, batch_size = args.batch_size, n_process = args.n_process)
+        for text, expected, actual in mismatches:
+            print(f"Mismatch for {text!r}: expected {expected!r}, got {actual!r}")
+        print(f"{len(texts) - len(mismatches)} of {len(texts)} tweets match")
+        raise SystemExit(1 if mismatches else 0)
 
-                # Determine sentiment category
-                if sentiment_val > 0:
-                    sentiment_category = 'Positive'
-                elif sentiment_val < 0:
-                    sentiment_category = 'Negative'
-                else:
-                    sentiment_category = 'Neutral'
-                # Format the sentiment category so that it will be accepted into the PostgreSQL database
-                sentiment = f"'{sentiment_category}'"
-                # Format the embedding_vector so that it will be accepted into the PostgreSQL database
-                if len(embedding_vector) == 0:
-                    embedding_vector = None
-                else:
-                    embedding_vector = f"'{embedding_vector}'"
-
-                # Create a string representing SQLs INSERT VALUES function
-                insert_query = f"INSERT INTO tweets(created_at, lang, text, full_text, sentiment, sentiment_val, embedding_vector) VALUES ({data['created_at']}, {data['lang']}, {data['text']}, {data['full_text']}, {sentiment}, {sentiment_val}, {embedding_vector})"
-                
-                # Execute the query
-                cursor.execute(insert_query)
-                connection.commit()
+    # Load in SpaCy for data cleaning, without the components that the cleaning filter does not use
+    nlp = load_cleaner()
+
+    # Cleaned texts and embeddings that were already computed by an earlier run are read from here instead of being computed again
+    text_cache = TextCache(args.text_cache, args.text_cache_mb * 1024 ** 2) if args.text_cache else None
+
+    # Load the BERT model and tokenizer. Every embedding goes through the engine, which also reads and fills the text cache
+    engine = EmbeddingEngine(batch_size = args.embed_batch_size, num_threads = args.torch_threads, cache = text_cache)
+
+    # Check that the batched embeddings match one forward pass per tweet before loading anything
+    if args.verify_embeddings:
+        with open_source(args.source) as file:
+            texts = [data['full_text'] for text, (offset, data) in itertools.islice(parse_tweets(file), args.verify_embeddings)]
+        difference = verify_embeddings(engine, texts)
+        print(f"Largest difference between batched and single embeddings: {difference:.2e}")
+        raise SystemExit(1 if difference > 1e-4 else 0)
+
+    # Keeps the time spent in each stage so that a tweets/sec figure can be printed for each of them
+    timer = StageTimer()
+
+    try: 
+        connection = connect()
+
+        # The loader writes the rows in chunks and keeps the checkpoint that lets a crashed run pick up where it stopped. The checkpoint belongs to this
+        # exact file (see source_identity), so a new file with the same name starts from the beginning. Each chunk's rows are given their topic cluster
+        # in the chunk's own transaction, with the centroids that are saved at that moment, so running clusters.py during a load is safe: the chunks
+        # after it use the new clusters (until clusters have been trained, the tweets are loaded without a cluster_id)
+        loader = BulkLoader(connection, source_identity(args.source), chunk_size = args.load_chunk, clusters = ClusterAssigner(connection))
+        if args.restart:
+            loader.reset()
+        start_offset, row_count = loader.checkpoint()
+        if start_offset and not checkpoint_matches(args.source, start_offset, connection):
+            print(f"The checkpoint at byte {start_offset} does not match {args.source} any more, so it is read from the beginning")
+            loader.reset()
+            start_offset, row_count = 0, 0
+        if start_offset:
+            print(f"Resuming after {row_count} rows at byte {start_offset}")
+
+        # The stages run at the same time, each in its own thread (see pipeline.py): parse -> (skip) -> clean -> embed -> sentiment, with the loader
+        # reading the finished rows in this thread. Between two stages at most --queue-size chunks of tweets are waiting
+        item_queue_size = args.queue_size * args.embed_chunk
+        stats = Counter()
+        with open_source(args.source) as file:
+            pipeline = Pipeline('parse', timer.wrap('parse', parse_tweets(file, start_offset)), item_queue_size, timer)
+            if args.incremental:
+                # The lookups use their own connection, since the loader's connection is in the middle of a transaction on another thread
+                lookup_connection = connect()
+                column = DEDUPE_COLUMNS[args.incremental]
+                pipeline.add_stage('skip', lambda items: skip_existing(items, lookup_connection, column, args.embed_chunk, stats), item_queue_size)
+            pipeline.add_stage('clean', lambda items: timer.wrap('clean', clean_stream(nlp, items, batch_size = args.batch_size, n_process = args.n_process,
+                                                                                     cache = text_cache)),
+                               item_queue_size)
+            pipeline.add_stage('embed', lambda items: embed_chunks(items, engine, args.embed_chunk, timer), args.queue_size)
+            pipeline.add_stage('sentiment', lambda chunks: build_rows(chunks, timer), args.queue_size)
+
+            for rows in pipeline.run('insert'):
+                for row, offset in rows:
+                    # Hand the row to the loader, which writes it to the database once its chunk is full. The insert stage only counts the rows once
+                    # they have actually been written
+                    with timer.time('insert', 0) as block:
+                        block.count = loader.add(row, offset)
+
+            # Write the rows in the last, partly filled chunk
+            with timer.time('insert', 0) as block:
+                block.count = loader.flush()
+
+        if args.incremental:
+            print(f"Skipped {stats['skipped']} tweets that were already loaded")
                    
-            # If there is an error, print out the error message
-            except json.JSONDecodeError as e:
-                print(f"Error decoding JSON: {e}")
-except (Exception, psycopg2.Error) as error:
-    print("Error:", error, data['created_at'], data['text']) 
-
-# This is just so that I know when the code was completed
-print('Done!')
+    except (Exception, psycopg2.Error) as error:
+        print("Error:", error) 
+
+    # Print the time, share of the run and tweets/sec figure of each stage, and how often the text cache already had the result
+    timer.report()
+    if text_cache is not None:
+        text_cache.report()
+    if args.metrics_file:
+        timer.write_metrics(args.metrics_file)
+
+    # This is just so that I know when the code was completed
+    print('Done!')
@@ -0,0 +1,148 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+import numpy as np
+
+'''
+TextCache keeps the cleaned text and the BERT embedding of every text preprocessing.py has already processed in a SQLite file, so that retweets, repeated
+texts and whole re-runs (for example after a schema change) read the results instead of running SpaCy and BERT again.
+
+Every entry is keyed by a SHA-256 hash of its namespace and the text. The namespace names the kind of result together with the model and its version, for
+example "clean:en_core_web_sm-3.7.1:1" or "embed:bert-base-uncased@<revision>", so a new model (or a change to the cleaning filter) never reads results
+that were made by the old one. The cleaning entries are keyed by the raw text and the embedding entries by the text that was actually embedded.
+
+The file is kept under max_bytes. Each entry records when it was last used, and once the file holds more than max_bytes of values the least recently used
+entries are removed. The hits and misses of each kind are counted so that the end of a run can report the hit rate.
+'''
+
+# Default size limit of the cache, in bytes
+MAX_BYTES = 2 * 1024 ** 3
+
+# Number of keys looked up in one query. SQLite allows at most 999 parameters in older versions
+LOOKUP_BATCH = 500
+
+# The embeddings are stored as little-endian float32, the same format as the embedding_vector column
+VECTOR_DTYPE = '<f4'
+
+
+class TextCache:
+    def __init__(self, path, max_bytes = MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+        # The cleaning and embedding stages run in different threads, and SQLite connections cannot be shared between threads
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        with self._connection() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS text_cache (
+                    key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL
+                )
+            """)
+            connection.execute("CREATE INDEX IF NOT EXISTS ix_text_cache_last_used ON text_cache (last_used)")
+            self.size = connection.execute("SELECT coalesce(sum(size), 0) FROM text_cache").fetchone()[0]
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout = 30)
+            # Write-ahead logging lets one stage read while the other writes
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def key(namespace, text):
+        return hashlib.sha256(f"{namespace}\0{text}".encode("utf-8")).hexdigest()
+
+    # Returns a {text: value} dictionary with the values of the texts that are in the cache
+    def get_many(self, namespace, texts):
+        keys = {self.key(namespace, text): text for text in set(texts)}
+        found = {}
+        key_list = list(keys)
+        with self._connection() as connection:
+            for start in range(0, len(key_list), LOOKUP_BATCH):
+                batch = key_list[start:start + LOOKUP_BATCH]
+                placeholders = ", ".join("?" * len(batch))
+                for key, value in connection.execute(f"SELECT key, value FROM text_cache WHERE key IN ({placeholders})", batch):
+                    found[keys[key]] = value
+                connection.execute(f"UPDATE text_cache SET last_used = ? WHERE key IN ({placeholders})", [time.time()] + batch)
+        kind = namespace.split(":", 1)[0]
+        with self._lock:
+            self.hits[kind] += len(found)
+            self.misses[kind] += len(keys) - len(found)
+        return found
+
+    # Stores a {text: value} dictionary and removes the least recently used entries if the cache has grown past its limit
+    def put_many(self, namespace, values):
+        if not values:
+            return
+        now = time.time()
+        records = [(self.key(namespace, text), value, len(value), now) for text, value in values.items()]
+        with self._connection() as connection:
+            # Entries that another thread or run wrote in the meantime are replaced, so their old size is taken off first
+            replaced = 0
+            key_list = [record[0] for record in records]
+            for start in range(0, len(key_list), LOOKUP_BATCH):
+                batch = key_list[start:start + LOOKUP_BATCH]
+                replaced += connection.execute(f"SELECT coalesce(sum(size), 0) FROM text_cache WHERE key IN ({', '.join('?' * len(batch))})",
+                                               batch).fetchone()[0]
+            connection.executemany("INSERT OR REPLACE INTO text_cache (key, value, size, last_used) VALUES (?, ?, ?, ?)", records)
+        with self._lock:
+            self.size += sum(record[2] for record in records) - replaced
+            over_limit = self.size > self.max_bytes
+        if over_limit:
+            self._evict()
+
+    # Removes the least recently used entries until the cache is back under 90% of its limit, so that it is not trimmed again on every write
+    def _evict(self):
+        target = int(self.max_bytes * 0.9)
+        with self._lock, self._connection() as connection:
+            while self.size > target:
+                records = connection.execute("SELECT key, size FROM text_cache ORDER BY last_used LIMIT 1000").fetchall()
+                if not records:
+                    self.size = 0
+                    break
+                # Only as many of the oldest entries as needed are removed
+                removed = []
+                for key, size in records:
+                    if self.size <= target:
+                        break
+                    removed.append((key,))
+                    self.size -= size
+                connection.executemany("DELETE FROM text_cache WHERE key = ?", removed)
+
+    # Returns a {text: cleaned_text} dictionary for the texts that are in the cache
+    def get_texts(self, namespace, texts):
+        return {text: value.decode("utf-8") for text, value in self.get_many(namespace, texts).items()}
+
+    def put_texts(self, namespace, cleaned_texts):
+        self.put_many(namespace, {text: cleaned.encode("utf-8") for text, cleaned in cleaned_texts.items()})
+
+    # Returns a {text: vector} dictionary of float32 arrays for the texts that are in the cache
+    def get_vectors(self, namespace, texts):
+        return {text: np.frombuffer(value, dtype = VECTOR_DTYPE).astype(np.float32) for text, value in self.get_many(namespace, texts).items()}
+
+    def put_vectors(self, namespace, vectors):
+        self.put_many(namespace, {text: np.asarray(vector, dtype = VECTOR_DTYPE).tobytes() for text, vector in vectors.items()})
+
+    # Returns the hits, misses and hit rate of each kind of entry, plus the size of the file's values in bytes
+    def stats(self):
+        with self._lock:
+            kinds = {}
+            for kind in sorted(set(self.hits) | set(self.misses)):
+                lookups = self.hits[kind] + self.misses[kind]
+                kinds[kind] = {"hits": self.hits[kind], "misses": self.misses[kind], "hit_rate": self.hits[kind] / lookups if lookups else 0.0}
+            return {"kinds": kinds, "bytes": self.size, "max_bytes": self.max_bytes}
+
+    # Prints one line per kind of entry with its hit rate, and how full the cache is
+    def report(self):
+        stats = self.stats()
+        for kind, figures in stats["kinds"].items():
+            print(f"{kind + ' cache':<16} {figures['hits']:>8} hits {figures['misses']:>8} misses {figures['hit_rate'] * 100:>6.1f}% hit rate")
+        print(f"Text cache {os.path.basename(self.path)}: {stats['bytes'] / 1024 ** 2:.1f} MB of {stats['max_bytes'] / 1024 ** 2:.1f} MB")
@@ -0,0 +1,122 @@
+import os
+import threading
+import time
+from collections import defaultdict
+
+'''
+StageTimer keeps track of how long each stage of the preprocessing run takes and how many tweets pass through it, so that every stage can be reported as a
+tweets/sec figure at the end of the run. Stages can be nested (nlp.pipe pulls tweets out of the parsing stage while it runs), so the time an inner stage takes
+is subtracted from the stage that called it and each stage only reports its own work. The stages can also run in separate threads (see pipeline.py), in
+which case the shares of the run add up to more than 100%.
+
+At the end of the run the same figures can be written to a file in the Prometheus text format (write_metrics), which a node_exporter textfile collector
+can pick up next to the /metrics output of the API.
+'''
+
+
+class StageTimer:
+    def __init__(self):
+        # Total seconds spent in each stage
+        self.seconds = defaultdict(float)
+        # Number of tweets that went through each stage
+        self.counts = defaultdict(int)
+        # Number of timed blocks (or items, for wrapped iterators) in each stage
+        self.calls = defaultdict(int)
+        # Longest single block in each stage
+        self.slowest = defaultdict(float)
+        # Holds the time spent in nested stages for every stage that is currently running, separately for every thread
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.started = time.perf_counter()
+
+    # Times a block of code, for example: with timer.time('insert'): ...
+    def time(self, stage, count = 1):
+        return _TimedBlock(self, stage, count)
+
+    # Wraps an iterator so that the time spent producing each item is added to the stage. This is how streamed stages, like nlp.pipe, are measured
+    def wrap(self, stage, iterable):
+        iterator = iter(iterable)
+        while True:
+            start = self._start()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self._stop(stage, 0, start)
+                return
+            self._stop(stage, 1, start)
+            yield item
+
+    # Returns the tweets/sec figure for a stage
+    def rate(self, stage):
+        seconds = self.seconds[stage]
+        return self.counts[stage] / seconds if seconds > 0 else 0.0
+
+    # Prints one line per stage in the order the stages were first seen, with the share of the whole run each stage took. Whatever is left over is the
+    # work done outside the timed stages
+    def report(self):
+        total = time.perf_counter() - self.started
+        print(f"{'stage':<16} {'tweets':>8} {'seconds':>10} {'share':>7} {'tweets/sec':>11} {'ms/call':>9} {'slowest ms':>11}")
+        for stage in self.seconds:
+            share = self.seconds[stage] / total * 100 if total > 0 else 0.0
+            per_call = self.seconds[stage] / self.calls[stage] * 1000 if self.calls[stage] else 0.0
+            print(f"{stage:<16} {self.counts[stage]:>8} {self.seconds[stage]:>10.2f} {share:>6.1f}% {self.rate(stage):>11.1f} {per_call:>9.2f} "
+                  f"{self.slowest[stage] * 1000:>11.2f}")
+        untimed = total - sum(self.seconds.values())
+        # There is no untimed remainder when the stages ran at the same time
+        if untimed > 0:
+            print(f"{'other':<16} {'':>8} {untimed:>10.2f} {untimed / total * 100:>6.1f}%")
+        print(f"{'total':<16} {'':>8} {total:>10.2f}")
+
+    # Writes the seconds, tweets and calls of every stage to a file in the Prometheus text format. The file is replaced in one step so that a collector
+    # never reads half of it
+    def write_metrics(self, path):
+        lines = []
+        for name, description, values in (("preprocessing_stage_seconds_total", "Seconds spent in each preprocessing stage", self.seconds),
+                                           ("preprocessing_stage_tweets_total", "Tweets that went through each preprocessing stage", self.counts),
+                                           ("preprocessing_stage_calls_total", "Timed blocks in each preprocessing stage", self.calls)):
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} counter"]
+            lines += [f'{name}{{stage="{stage}"}} {value}' for stage, value in values.items()]
+        lines += ["# HELP preprocessing_run_seconds Length of the preprocessing run", "# TYPE preprocessing_run_seconds gauge",
+                  f"preprocessing_run_seconds {time.perf_counter() - self.started}"]
+        temporary_path = path + ".tmp"
+        with open(temporary_path, "w") as file:
+            file.write("\n".join(lines) + "\n")
+        os.replace(temporary_path, path)
+
+    # The stack of running stages in the current thread
+    def _stack(self):
+        if not hasattr(self._local, "nested"):
+            self._local.nested = []
+        return self._local.nested
+
+    def _start(self):
+        self._stack().append(0.0)
+        return time.perf_counter()
+
+    def _stop(self, stage, count, start):
+        elapsed = time.perf_counter() - start
+        nested_stages = self._stack()
+        nested = nested_stages.pop()
+        with self._lock:
+            self.seconds[stage] += elapsed - nested
+            self.counts[stage] += count
+            self.calls[stage] += 1
+            self.slowest[stage] = max(self.slowest[stage], elapsed - nested)
+        # Let the stage that is running around this one know how much of its time belonged to this stage
+        if nested_stages:
+            nested_stages[-1] += elapsed
+
+
+class _TimedBlock:
+    def __init__(self, timer, stage, count):
+        self.timer = timer
+        self.stage = stage
+        self.count = count
+
+    def __enter__(self):
+        self.start = self.timer._start()
+        return self
+
+    def __exit__(self, *exc):
+        self.timer._stop(self.stage, self.count, self.start)
+        return False